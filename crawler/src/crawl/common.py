@@ -0,0 +1,318 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""pref_site_introspect.py / pref_site_mapper.py の共通部品"""
+import atexit
+import json
+import re
+import sqlite3
+import threading
+import time
+from functools import lru_cache
+from pathlib import Path
+from urllib import robotparser
+from urllib.parse import parse_qsl, urlencode, urljoin, urlparse, urlunparse
+
+import requests
+from lxml import etree
+try:
+    import orjson  # あれば JSONL ログを C 実装で直接 bytes にする
+except ImportError:
+    orjson = None
+from lxml import html as lxml_html
+
+# ルートから実行前提
+ROBOTS_CACHE_PATH = Path("data/processed/robots_cache.json")
+ROBOTS_TTL = 24 * 3600  # 秒
+HTTP_CACHE_PATH = Path("data/processed/http_cache.db")
+
+# 同じURLを何度も分解するので結果を使い回す（ParseResult は不変）
+parse_url = lru_cache(maxsize=16384)(urlparse)
+
+# ========= robots.txt =========
+class RobotsCache:
+    """
+    robots.txt の判定。取得した本文は scheme+netloc 単位でディスクに保存し、
+    TTL 内の再実行では取得し直さずにパースだけ行う。
+    """
+    def __init__(self, ua: str, session=None, path: Path = ROBOTS_CACHE_PATH,
+                 ttl: int = ROBOTS_TTL, timeout: int = 20):
+        self.ua = ua
+        self.session = session or requests
+        self.path = path
+        self.ttl = ttl
+        self.timeout = timeout
+        self.cache = {}    # host -> RobotFileParser
+        self.entries = {}  # host -> {"status":..., "body":..., "ts":...}
+        self._dirty = False
+        self._lock = threading.Lock()
+        if path.exists():
+            try:
+                self.entries = json.loads(path.read_text(encoding="utf-8"))
+            except Exception:
+                self.entries = {}
+        atexit.register(self.save)
+
+    def _download(self, host: str):
+        try:
+            r = self.session.get(urljoin(host, "/robots.txt"), timeout=self.timeout)
+        except Exception:
+            return None
+        if r.status_code >= 500:  # 一時的な失敗は保存しない
+            return None
+        body = r.content.decode("utf-8", errors="ignore") if r.status_code < 400 else ""
+        return {"status": r.status_code, "body": body, "ts": time.time()}
+
+    @staticmethod
+    def _build(entry) -> robotparser.RobotFileParser:
+        # RobotFileParser.read() と同じ扱い: 401/403 は全拒否、その他4xxは全許可
+        rp = robotparser.RobotFileParser()
+        status = entry["status"]
+        if status in (401, 403):
+            rp.disallow_all = True
+        elif 400 <= status < 500:
+            rp.allow_all = True
+        else:
+            rp.parse(entry["body"].splitlines())
+        return rp
+
+    def _load(self, host: str) -> robotparser.RobotFileParser:
+        with self._lock:
+            entry = self.entries.get(host)
+        if not entry or time.time() - entry.get("ts", 0) >= self.ttl:
+            entry = self._download(host)
+            if entry is None:
+                # 取得失敗時は未読のパーサ（= 全拒否）。従来の rp.read() 失敗時と同じ
+                return robotparser.RobotFileParser()
+            with self._lock:
+                self.entries[host] = entry
+                self._dirty = True
+        return self._build(entry)
+
+    def allowed(self, url: str) -> bool:
+        p = parse_url(url)
+        host = p.scheme + "://" + p.netloc
+        rp = self.cache.get(host)
+        if rp is None:
+            rp = self.cache[host] = self._load(host)
+        return rp.can_fetch(self.ua, url)
+
+    def save(self):
+        with self._lock:
+            if not self._dirty:
+                return
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            self.path.write_text(json.dumps(self.entries, ensure_ascii=False), encoding="utf-8")
+            self._dirty = False
+
+# ========= 条件付きGET =========
+class CondCache:
+    """
+    URLごとの ETag / Last-Modified と前回の解析結果を SQLite に保存する。
+    次回は If-None-Match / If-Modified-Since を付けて取得し、304 なら保存済みの結果を使う。
+    ns はクローラごとの名前空間（解析結果の形が違うため）。
+    """
+    def __init__(self, path: Path = HTTP_CACHE_PATH):
+        self.path = path
+        self._conn = None
+        self._lock = threading.Lock()
+
+    def _db(self):
+        # import しただけではファイルを作らないよう、初回利用時に開く
+        if self._conn is None:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            self._conn = sqlite3.connect(self.path, check_same_thread=False)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("PRAGMA synchronous=NORMAL")
+            self._conn.execute("""CREATE TABLE IF NOT EXISTS cond (
+                ns TEXT, url TEXT, etag TEXT, last_mod TEXT, ct TEXT, meta TEXT,
+                PRIMARY KEY (ns, url))""")
+        return self._conn
+
+    def get(self, ns: str, url: str):
+        with self._lock:
+            row = self._db().execute(
+                "SELECT etag, last_mod, ct, meta FROM cond WHERE ns=? AND url=?", (ns, url)).fetchone()
+        if row is None:
+            return None
+        return {"etag": row[0], "last_mod": row[1], "ct": row[2], "meta": json.loads(row[3])}
+
+    def put(self, ns: str, url: str, ct: str, validators: dict, meta: dict):
+        etag, last_mod = validators.get("etag"), validators.get("last_mod")
+        if not (etag or last_mod):  # 検証子がなければ次回も普通に取るしかない
+            return
+        with self._lock:
+            self._db().execute("INSERT OR REPLACE INTO cond VALUES (?,?,?,?,?,?)",
+                               (ns, url, etag, last_mod, ct, json.dumps(meta, ensure_ascii=False)))
+            self._conn.commit()
+
+    @staticmethod
+    def headers(entry) -> dict:
+        h = {}
+        if entry.get("etag"):
+            h["If-None-Match"] = entry["etag"]
+        if entry.get("last_mod"):
+            h["If-Modified-Since"] = entry["last_mod"]
+        return h
+
+    @staticmethod
+    def validators(r) -> dict:
+        return {"etag": r.headers.get("ETag"), "last_mod": r.headers.get("Last-Modified")}
+
+# ========= URL 正規化 =========
+_SLASHES = re.compile(r"/+")
+_DEFAULT_PORTS = {"http": 80, "https": 443}
+
+@lru_cache(maxsize=16384)
+def canon(url: str) -> str:
+    """
+    訪問済み判定用のURLキー。ホスト小文字化・既定ポート/フラグメント除去・
+    連続スラッシュの圧縮・クエリのソートで、見た目だけ違う同一URLを1つにまとめる。
+    """
+    try:
+        p = parse_url(url)
+        scheme = p.scheme.lower()
+        netloc = (p.hostname or "").lower()
+        if p.port and p.port != _DEFAULT_PORTS.get(scheme):
+            netloc += f":{p.port}"
+    except ValueError:  # 不正なポートなど
+        return url
+    path = _SLASHES.sub("/", p.path) or "/"
+    query = urlencode(sorted(parse_qsl(p.query, keep_blank_values=True)))
+    return urlunparse((scheme, netloc, path, p.params, query, ""))
+
+# ========= HTML 解析（lxml） =========
+_tls = threading.local()
+
+def _html_parser():
+    # lxml のパーサはスレッド間で共有できないのでスレッドごとに1つ持つ
+    p = getattr(_tls, "html_parser", None)
+    if p is None:
+        p = _tls.html_parser = lxml_html.HTMLParser(remove_comments=True, remove_pis=True)
+    return p
+
+# XHTML 先頭の <?xml ... encoding=...?>。デコード済みの str に付いていると lxml が ValueError を出す
+_XML_DECL = re.compile(r"^\s*<\?xml[^>]*\?>")
+
+def html_tree(html: str):
+    """文字列から lxml の木を作る。空文書は None。コメント/PI と script/style は本文に含めない"""
+    if not html or not html.strip():
+        return None
+    html = _XML_DECL.sub("", html, count=1)
+    try:
+        tree = lxml_html.document_fromstring(html, parser=_html_parser())
+    except (etree.ParserError, ValueError):
+        return None
+    etree.strip_elements(tree, "script", "style", with_tail=False)
+    return tree
+
+def node_text(el, sep: str = " ") -> str:
+    """BeautifulSoup の get_text(sep, strip=True) 相当"""
+    return sep.join(t.strip() for t in el.itertext() if t.strip())
+
+# ========= 県別ログ =========
+class PrefLogs:
+    """
+    県ごとの .log / .jsonl を1回だけ開いて書き続ける（イベントごとの open/close をしない）。
+    県の処理が終わったら close(name)、閉じ忘れはプロセス終了時にまとめて閉じる。
+    """
+    def __init__(self, log_dir: Path):
+        self.log_dir = log_dir
+        self._fhs = {}
+        self._lock = threading.Lock()
+        atexit.register(self.close_all)
+
+    def _fh(self, name: str, ext: str):
+        key = (name, ext)
+        fh = self._fhs.get(key)
+        if fh is None:
+            with self._lock:
+                fh = self._fhs.get(key)
+                if fh is None:
+                    path = self.log_dir / f"{name}{ext}"
+                    if ext == ".jsonl":  # JSONL は bytes のまま書く
+                        fh = open(path, "ab", buffering=1 << 16)
+                    else:
+                        fh = open(path, "a", encoding="utf-8", buffering=1 << 16)
+                    self._fhs[key] = fh
+        return fh
+
+    def text(self, name: str, msg: str):
+        ts = time.strftime("%Y-%m-%d %H:%M:%S")
+        self._fh(name, ".log").write(f"[{ts}] {msg}\n")
+
+    def event(self, name: str, ev: dict):
+        ev = {"ts": time.strftime("%Y-%m-%dT%H:%M:%S"), **ev}
+        if orjson is not None:
+            line = orjson.dumps(ev)
+        else:
+            line = json.dumps(ev, ensure_ascii=False).encode("utf-8")
+        self._fh(name, ".jsonl").write(line + b"\n")
+
+    def close(self, name: str):
+        with self._lock:
+            for ext in (".log", ".jsonl"):
+                fh = self._fhs.pop((name, ext), None)
+                if fh is not None:
+                    fh.close()
+
+    def close_all(self):
+        with self._lock:
+            for fh in self._fhs.values():
+                fh.close()
+            self._fhs.clear()
+
+# ========= サイズ上限つき取得 =========
+MAX_BYTES_PDF = 2_000_000   # parse_pdf_quick の size_limit と揃える
+MAX_BYTES_HTML = 8_000_000
+
+def max_bytes_for(url: str, ct: str) -> int:
+    if "pdf" in (ct or "") or url.lower().endswith(".pdf"):
+        return MAX_BYTES_PDF
+    return MAX_BYTES_HTML
+
+def read_capped(r, max_bytes: int):
+    """
+    stream=True のレスポンス本文を上限つきで読む。上限を超えたら途中で打ち切って None。
+    Content-Length があればダウンロード前に判定する（圧縮時は展開後サイズで判定）。
+    """
+    cl = r.headers.get("Content-Length")
+    if cl and cl.isdigit() and int(cl) > max_bytes:
+        return None
+    chunks = []
+    total = 0
+    for chunk in r.iter_content(65536):
+        total += len(chunk)
+        if total > max_bytes:
+            return None
+        chunks.append(chunk)
+    return b"".join(chunks)
+
+# ========= ホスト単位の同時接続制御 =========
+class HostLimiter:
+    """同一ホストへの同時リクエスト数と開始間隔を制限する（県・スレッドをまたいで共有）"""
+    def __init__(self, per_host: int = 3):
+        self.per_host = per_host
+        self._sems = {}
+        self._next = {}  # host -> 次に開始してよい時刻（monotonic）
+        self._lock = threading.Lock()
+
+    def slot(self, url: str) -> threading.BoundedSemaphore:
+        host = parse_url(url).netloc
+        with self._lock:
+            sem = self._sems.get(host)
+            if sem is None:
+                sem = self._sems[host] = threading.BoundedSemaphore(self.per_host)
+        return sem
+
+    def wait(self, url: str, interval: float):
+        """
+        同一ホストへのリクエスト開始を interval 秒以上あける。
+        直前が別ホストなら待たない。枠はロック内で予約し、スリープはロックの外で行う。
+        """
+        host = parse_url(url).netloc
+        with self._lock:
+            now = time.monotonic()
+            start = max(now, self._next.get(host, 0.0))
+            self._next[host] = start + interval
+        if start > now:
+            time.sleep(start - now)
@@ -2,21 +2,29 @@
 # -*- coding: utf-8 -*-
 import argparse
 import csv
+import heapq
 import io
-import json
-import queue
+import multiprocessing
+import os
 import re
+import threading
 import time
 from collections import defaultdict
-from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import datetime
+from functools import lru_cache
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
 from pathlib import Path
-from urllib.parse import urljoin, urlparse
+from urllib.parse import urljoin
 
 import requests
-from bs4 import BeautifulSoup
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 from dateutil import parser as dateparser
+from lxml import etree
 from pdfminer.high_level import extract_text as pdf_extract_text
-from urllib import robotparser
+import pypdfium2 as pdfium
+
+from common import CondCache, HostLimiter, PrefLogs, RobotsCache, canon, parse_url, html_tree, max_bytes_for, node_text, read_capped
 
 # ========= パス（プロジェクトルートから実行前提） =========
 INPUT_CSV = Path("data/processed/pref_boujosho_links.csv")
@@ -29,8 +37,19 @@ TIMEOUT = 20
 
 KEYWORDS  = ["予察","発生予察","発生情報","注意報","警報","バックナンバー","年度","病害虫","害虫","病害"]
 URL_HINTS = ["yosatsu","yosatu","yohou","byogaichu","gaicyu","gaichu","byogai","yosan"]
-YEAR_PAT  = re.compile(r"(令和\s?\d+年度?|平成\s?\d+年度?|20\d{2}(?:年度?)?)")
+# r=令和 / h=平成 / c=西暦。マッチごとに追加の正規表現を走らせなくて済むよう数字を名前付きで取る
+YEAR_PAT  = re.compile(r"令和\s?(?P<r>\d+)年度?|平成\s?(?P<h>\d+)年度?|(?P<c>20\d{2})(?:年度?)?")
 FUTURE_GUARD_WORDS = ("計画","予定","案","募集","予算","方針","公募")
+# HTMLはまず先頭だけ解析し、リンクが少なすぎるときだけ全体を解析し直す
+HTML_HEAD_BYTES = 65536
+HTML_HEAD_MIN_ANCHORS = 150
+# URL解決の前に捨てるリンク（同一ページ内・スクリプト・メール・電話）
+SKIP_HREF_PREFIXES = ("#","javascript:","mailto:","tel:")
+# 多数のアンカーに対して毎回呼ぶので、キーワード群は1本の正規表現にまとめておく
+KW_RE     = re.compile("|".join(map(re.escape, KEYWORDS)))
+URL_RE    = re.compile("|".join(map(re.escape, URL_HINTS)))
+GUARD_RE  = re.compile("|".join(map(re.escape, FUTURE_GUARD_WORDS)))
+YEAR4_RE  = re.compile(r"20\d{2}")
 
 # ========= 県別ログ =========
 def setup_dirs():
@@ -41,112 +60,121 @@ def setup_dirs():
 def safe_name(s: str) -> str:
     return re.sub(r'[\\/:*?"<>|]', "_", s)
 
+PLOG = PrefLogs(LOG_DIR)
+
 def pref_log_txt(pref: str, msg: str):
-    ts = time.strftime("%Y-%m-%d %H:%M:%S")
-    p = LOG_DIR / f"{safe_name(pref)}.log"
-    with p.open("a", encoding="utf-8") as f:
-        f.write(f"[{ts}] {msg}\n")
+    PLOG.text(safe_name(pref), msg)
 
 def pref_log_event(pref: str, event: dict):
-    event = {"ts": time.strftime("%Y-%m-%dT%H:%M:%S"), **event}
-    p = LOG_DIR / f"{safe_name(pref)}.jsonl"
-    with p.open("a", encoding="utf-8") as f:
-        f.write(json.dumps(event, ensure_ascii=False) + "\n")
-
-# ========= robots.txt =========
-class RobotsCache:
-    def __init__(self):
-        self.cache = {}
-    def allowed(self, url: str) -> bool:
-        host = urlparse(url).scheme + "://" + urlparse(url).netloc
-        if host not in self.cache:
-            rp = robotparser.RobotFileParser()
-            rp.set_url(urljoin(host, "/robots.txt"))
-            try:
-                rp.read()
-            except Exception:
-                pass
-            self.cache[host] = rp
-        return self.cache[host].can_fetch(UA, url)
-
-ROBOTS = RobotsCache()
+    PLOG.event(safe_name(pref), event)
 
 # ========= HTTP =========
+# 同一ドメインへ連続アクセスするので、Session で接続（TCP/TLS）を使い回す
+SESSION = requests.Session()
+SESSION.headers.update({"User-Agent": UA})
+
+ROBOTS = RobotsCache(UA, SESSION, timeout=TIMEOUT)
+HOSTS = HostLimiter()
+COND = CondCache()
+COND_NS = "introspect"
+
+def setup_session(workers: int):
+    """並列数に合わせて接続プールを確保し、一時的な失敗は軽くリトライ"""
+    retry = Retry(total=2, backoff_factor=0.3, status_forcelist=[429,500,502,503,504],
+                  raise_on_status=False)
+    adapter = HTTPAdapter(pool_connections=workers, pool_maxsize=workers*4, max_retries=retry)
+    SESSION.mount("http://", adapter)
+    SESSION.mount("https://", adapter)
+
 def fetch(url: str, method="GET"):
+    """
+    (status, ct, body, err, cond) を返す。cond は 304 のとき保存済みエントリ（meta 付き）、
+    それ以外はレスポンスの検証子（ETag / Last-Modified）。
+    """
     if not ROBOTS.allowed(url):
-        return None, None, None, "robots_disallow"
-    headers = {"User-Agent": UA}
+        return None, None, None, "robots_disallow", None
     try:
         if method == "HEAD":
-            r = requests.head(url, headers=headers, timeout=TIMEOUT, allow_redirects=True)
-            return r.status_code, r.headers.get("Content-Type","").lower(), None, None
-        r = requests.get(url, headers=headers, timeout=TIMEOUT)
-        ct = r.headers.get("Content-Type","").lower()
-        return r.status_code, ct, r.content, None
+            r = SESSION.head(url, timeout=TIMEOUT, allow_redirects=True)
+            return r.status_code, r.headers.get("Content-Type","").lower(), None, None, None
+        cached = COND.get(COND_NS, url)
+        headers = CondCache.headers(cached) if cached else None
+        with SESSION.get(url, timeout=TIMEOUT, stream=True, headers=headers) as r:
+            if r.status_code == 304 and cached:
+                return 304, cached["ct"], None, None, cached
+            ct = r.headers.get("Content-Type","").lower()
+            body = read_capped(r, max_bytes_for(url, ct))
+            if body is None:
+                return r.status_code, ct, None, "too_large", CondCache.validators(r)
+            return r.status_code, ct, body, None, CondCache.validators(r)
     except Exception as e:
-        return None, None, None, str(e)
+        return None, None, None, str(e), None
 
 # ========= 共通解析 =========
-def is_same_domain(base: str, link: str) -> bool:
+def parse_meta_time(val: str):
+    """公開日メタの日時。ほぼ ISO 8601 なので fromisoformat を先に試し、だめなら dateutil"""
+    val = val.strip()
     try:
-        b = urlparse(base).netloc.split(":")[0]
-        l = urlparse(link).netloc.split(":")[0]
-        return (b == l) or (b.endswith(".go.jp") and l.endswith(".go.jp"))
-    except Exception:
-        return False
+        return datetime.fromisoformat(val)
+    except ValueError:
+        try:
+            return dateparser.parse(val, fuzzy=True)
+        except Exception:
+            return None
 
 def extract_year_candidates(text: str):
     text = text.replace("　"," ")
     current_year = time.localtime().tm_year
     cand = []
+    n_text = len(text)
     for m in YEAR_PAT.finditer(text):
-        token = m.group(0).strip()
-        y = None
-        if token.startswith("令和"):
-            n = int(re.sub(r"\D","", token)); y = 2018 + n  # 令和1=2019
-        elif token.startswith("平成"):
-            n = int(re.sub(r"\D","", token)); y = 1988 + n  # 平成1=1989
+        r, h, c = m.group("r", "h", "c")
+        if r:
+            y = 2018 + int(r)  # 令和1=2019
+        elif h:
+            y = 1988 + int(h)  # 平成1=1989
         else:
-            num = re.search(r"20\d{2}", token)
-            if num: y = int(num.group(0))
-        if not y: continue
-        if y > current_year:  # 未来は除外
+            y = int(c)
+        if y > current_year or y < 1990:  # 未来は除外
             continue
-        start = max(0, m.start()-20); end = min(len(text), m.end()+20)
-        near = text[start:end]
-        if any(w in near for w in FUTURE_GUARD_WORDS):
+        # 前後20文字に「計画」「予定」などがあれば除外（スライスを作らず範囲指定で検索）
+        if GUARD_RE.search(text, max(0, m.start()-20), min(n_text, m.end()+20)):
             continue
-        if 1990 <= y <= current_year:
-            cand.append(y)
+        cand.append(y)
     return cand
 
-def parse_html(content_bytes: bytes):
+def _decode_html(content_bytes: bytes) -> str:
     try:
-        html = content_bytes.decode("utf-8", errors="ignore")
+        return content_bytes.decode("utf-8", errors="ignore")
     except Exception:
-        html = content_bytes.decode("cp932", errors="ignore")
-    soup = BeautifulSoup(html, "lxml")
+        return content_bytes.decode("cp932", errors="ignore")
+
+def parse_html(content_bytes: bytes):
+    # タイトル・メタ・見出し（8000字まで）・主要リンクは先頭 64KB にほぼ収まる
+    tree = html_tree(_decode_html(content_bytes[:HTML_HEAD_BYTES]))
+    anchors = tree.xpath("//a[@href]") if tree is not None else []
+    if len(content_bytes) > HTML_HEAD_BYTES and len(anchors) < HTML_HEAD_MIN_ANCHORS:
+        tree = html_tree(_decode_html(content_bytes))
+        anchors = tree.xpath("//a[@href]") if tree is not None else []
+    if tree is None:
+        return {"doc_type":"html","title":"","text_len":0,"years":[],"links":[]}
     # 公開日メタ
     meta_time = None
-    for sel, attr in [
-        ('meta[property="article:published_time"]', "content"),
-        ('meta[property="og:updated_time"]', "content"),
-        ('time[datetime]', "datetime"),
-    ]:
-        tag = soup.select_one(sel)
-        if tag and tag.get(attr):
-            try:
-                meta_time = dateparser.parse(tag.get(attr), fuzzy=True); break
-            except Exception:
-                pass
-    title = (soup.title.get_text(strip=True) if soup.title else "")[:200]
-    body  = " ".join(x.get_text(" ", strip=True) for x in soup.select("h1,h2,h3,p,li"))[:8000]
+    for xp in (
+        '//meta[@property="article:published_time"]/@content',
+        '//meta[@property="og:updated_time"]/@content',
+        '//time[@datetime]/@datetime',
+    ):
+        val = tree.xpath(xp)[:1]
+        if val and val[0]:
+            meta_time = parse_meta_time(val[0])
+            if meta_time: break
+    t = tree.find(".//title")
+    title = (node_text(t, "") if t is not None else "")[:200]
+    body  = " ".join(node_text(x) for x in tree.xpath("//h1|//h2|//h3|//p|//li"))[:8000]
     years = [meta_time.year] if meta_time else extract_year_candidates(title + " " + body)
     # リンク抽出（優先度計算用）
-    links = []
-    for a in soup.select("a[href]"):
-        href = a.get("href",""); text = a.get_text(" ", strip=True)
-        links.append((href, text))
+    links = [(a.get("href",""), node_text(a)) for a in anchors]
     return {
         "doc_type":"html",
         "title": title,
@@ -156,145 +184,245 @@ def parse_html(content_bytes: bytes):
     }
 
 def parse_xml(content_bytes: bytes):
+    # 逐次パースでテキストだけ集め、処理済み要素は捨てる（巨大なフィード/サイトマップ対策）
+    title = ""
+    parts = []
+    total = 0
     try:
-        xml = content_bytes.decode("utf-8", errors="ignore")
-    except Exception:
-        xml = content_bytes.decode("cp932", errors="ignore")
-    soup = BeautifulSoup(xml, "lxml-xml")
-    title = (soup.title.get_text(strip=True) if soup.title else "")[:200]
-    body  = soup.get_text(" ", strip=True)[:8000]
+        for _, el in etree.iterparse(io.BytesIO(content_bytes), events=("end",), recover=True):
+            if not isinstance(el.tag, str):  # コメント・処理命令
+                continue
+            txt = (el.text or "").strip()
+            if txt:
+                if not title and etree.QName(el).localname.lower() == "title":
+                    title = txt[:200]
+                parts.append(txt)
+                total += len(txt) + 1
+            el.clear(keep_tail=True)
+            if total > 8000:
+                break
+    except etree.XMLSyntaxError:
+        pass
+    body = " ".join(parts)[:8000]
     years = extract_year_candidates(title + " " + body)
     # XMLはリンク抽出を行わない（フィードなどのときはURLが本文にないことが多い）
     return {"doc_type":"xml","title":title,"text_len":len(body),"years":years,"links":[]}
 
+# PDFium はスレッドセーフではないので、県の並列処理をまたいで1本ずつ呼ぶ
+PDFIUM_LOCK = threading.Lock()
+# PDF解析（CPU処理）を回すプロセスプール。main() で作る。None ならその場で解析
+PDF_POOL = None
+PDF_TIMEOUT = 60  # 秒
+
+def pdf_first_page_text(content: bytes) -> str:
+    """1ページ目のテキスト。PDFium で開けないPDFは pdfminer で読み直す"""
+    try:
+        with PDFIUM_LOCK:
+            pdf = pdfium.PdfDocument(content)
+            try:
+                if len(pdf) == 0:
+                    return ""
+                page = pdf[0]
+                textpage = page.get_textpage()
+                txt = textpage.get_text_range()
+                textpage.close()
+                page.close()
+                return txt
+            finally:
+                pdf.close()
+    except pdfium.PdfiumError:
+        return pdf_extract_text(io.BytesIO(content), maxpages=1) or ""
+
 def parse_pdf_quick(url: str, ct: str, content: bytes, size_limit=2_000_000):
     # Content-Length 大きすぎるPDFは本文抽出せずメタのみ
     text_len = 0
     years = []
     if content and len(content) <= size_limit:
         try:
-            txt = pdf_extract_text(io.BytesIO(content), maxpages=1) or ""
+            txt = pdf_first_page_text(content)
             text_len = len(txt)
             years = extract_year_candidates(txt[:4000])
         except Exception:
             pass
     return {"doc_type":"pdf","title":"","text_len":text_len,"years":years,"links":[]}
 
+XLS_EXTS  = (".xlsx",".xls",".xlsm")
+HTML_EXTS = (".html",".htm","/")
+
+@lru_cache(maxsize=256)
+def ct_kind(ct: str):
+    """Content-Type だけで決まる種別（pdf > xml > html の順）。種類は少ないので値ごとに覚える"""
+    if not ct: return None
+    if "pdf" in ct: return "pdf"
+    if "xml" in ct: return "xml"
+    if "html" in ct: return "html"
+    return None
+
+@lru_cache(maxsize=16384)
 def classify_ext(url: str, ct: str):
     u = url.lower()
-    if (ct and "pdf" in ct) or u.endswith(".pdf"): return "pdf"
-    if (ct and "xml" in ct) or u.endswith(".xml"): return "xml"
+    k = ct_kind(ct)
+    if k == "pdf" or u.endswith(".pdf"): return "pdf"
+    if k == "xml" or u.endswith(".xml"): return "xml"
     if u.endswith(".csv"): return "csv"
     if u.endswith(".json"): return "json"
-    if any(u.endswith(x) for x in (".xlsx",".xls",".xlsm")): return "xls"
-    if (ct and ("html" in ct or "xhtml" in ct)) or any(u.endswith(x) for x in (".html",".htm","/")): return "html"
+    if u.endswith(XLS_EXTS): return "xls"
+    if k == "html" or u.endswith(HTML_EXTS): return "html"
     return "other"
 
 def priority_score(text: str, url: str):
+    text = text or ""
+    url_l = (url or "").lower()
     score = 0
-    for k in KEYWORDS:
-        if k in (text or ""): score += 3
-    for h in URL_HINTS:
-        if h in (url or "").lower(): score += 2
+    # 大半のアンカーはどれにも当たらないので1回の走査で弾く。
+    # 当たったときだけ語ごとに数える（「予察」と「発生予察」など重なる語があるため）
+    if KW_RE.search(text):
+        score += 3 * sum(1 for k in KEYWORDS if k in text)
+    if URL_RE.search(url_l):
+        score += 2 * sum(1 for h in URL_HINTS if h in url_l)
     # 年度・西暦がURLに含まれる場合は加点
-    if re.search(r"20\d{2}", url or ""): score += 1
-    if "back" in (url or "").lower() or "バックナンバー" in (text or ""): score += 2
+    if YEAR4_RE.search(url or ""): score += 1
+    if "back" in url_l or "バックナンバー" in text: score += 2
     return score
 
 # ========= クロール =========
-def introspect_pref(pref: str, start_url: str, max_pages=60, max_depth=2, sleep_sec=0.4):
+def introspect_pref(pref: str, start_url: str, max_pages=60, max_depth=2, sleep_sec=0.4, concurrency=3):
     print(f"[INTROSPECT] {pref} … {start_url}", flush=True)
     pref_log_txt(pref, f"[START] {pref} {start_url}")
     pref_log_event(pref, {"type":"start","pref":pref,"url":start_url})
 
-    visited = set()
-    q = queue.PriorityQueue()
+    visited = set()  # canon() 済みのURLキー
+    q = []  # heapq（この県のスレッドだけが触るのでロック不要）
     # (負の優先度, depth, url)
-    q.put((-10, 0, start_url, "root"))
-
-    rows_detail = []  # 明細
-    years_all = []
-
-    # ドメイン制限
-    base_netloc = urlparse(start_url).netloc
-
-    while not q.empty() and len(visited) < max_pages:
-        prio, depth, url, src = q.get()
-        if url in visited: continue
-        visited.add(url)
-        time.sleep(sleep_sec)
-
-        status, ct, body, err = fetch(url, method="GET")
-        pref_log_event(pref, {"type":"fetch","url":url,"status":status,"ct":ct,"bytes":len(body) if body else 0,"err":err})
-        if status != 200 or err:
-            rows_detail.append({"url":url,"depth":depth,"from":src,"status":status,"ctype":ct,"kind":"error","title":"","years":"","text_len":0})
-            continue
+    heapq.heappush(q, (-10, 0, start_url, "root"))
 
-        kind = classify_ext(url, ct)
-        meta = {"doc_type":kind,"title":"","text_len":0,"years":[],"links":[]}
-        try:
-            if kind == "html":
-                meta = parse_html(body)
-            elif kind == "xml":
-                meta = parse_xml(body)
-            elif kind == "pdf":
-                meta = parse_pdf_quick(url, ct, body)
-            else:
-                # CSV/JSON/XLS等は本文解析しない
-                pass
-        except Exception as e:
-            pref_log_event(pref, {"type":"parse_error","url":url,"msg":str(e)})
-
-        years_all += meta.get("years", []) or []
-        rows_detail.append({
-            "url": url,
-            "depth": depth,
-            "from": src,
-            "status": status,
-            "ctype": ct or "",
-            "kind": kind,
-            "title": meta.get("title",""),
-            "years": "|".join(str(x) for x in meta.get("years",[]) or []),
-            "text_len": meta.get("text_len",0),
-        })
-
-        # 次のリンクをキューへ（HTMLだけ）
-        if depth < max_depth and kind in ("html","xml"):
-            links = meta.get("links", [])
-            for href, text in links:
-                full = urljoin(url, href)
-                if not full.startswith("http"): continue
-                if not is_same_domain(start_url, full): continue
-                if full in visited: continue
-                p = priority_score(text, full)
-                q.put((-(p), depth+1, full, url))
+    # 明細はその場でCSVへ流し、集計はカウンタだけ持つ
+    inv_path = OUT_DIR / f"{safe_name(pref)}.inventory.csv"
+    inv_f = open(inv_path, "w", newline="", encoding="utf-8", buffering=1 << 20)
+    inv_w = csv.writer(inv_f)
+    inv_w.writerow(["url","depth","from","status","ctype","kind","title","years","text_len"])
+    counts = defaultdict(int)
+    n_rows = 0
+    pdf_texty = 0
+    earliest = latest = None
+
+    def emit(url, depth, src, status, ct, kind, title="", years=(), text_len=0):
+        nonlocal n_rows, pdf_texty, earliest, latest
+        inv_w.writerow([url, depth, src, status, ct, kind, title, "|".join(str(x) for x in years), text_len])
+        n_rows += 1
+        counts[kind] += 1
+        # PDFの“テキストPDF”っぽさ（text_len>50 を閾値）
+        if kind == "pdf" and text_len > 50:
+            pdf_texty += 1
+        if years:
+            lo, hi = min(years), max(years)
+            earliest = lo if earliest is None else min(earliest, lo)
+            latest = hi if latest is None else max(latest, hi)
+
+    # ドメイン制限（同一ホスト、または起点が .go.jp なら .go.jp 同士は同一扱い）
+    base_host = (parse_url(start_url).hostname or "").lower()
+    base_is_gojp = base_host.endswith(".go.jp")
+
+    def polite_fetch(url):
+        with HOSTS.slot(url):
+            HOSTS.wait(url, sleep_sec)
+            return fetch(url, method="GET")
+
+    pending_pdfs = []  # (future, url, depth, src, status, ct, cond)
+
+    with inv_f, ThreadPoolExecutor(max_workers=concurrency) as pool:
+        while q and len(visited) < max_pages:
+            # 優先度上位から同時取得数ぶん取り出してまとめて取得（キュー操作はこのスレッドだけ）
+            batch = []
+            while q and len(batch) < concurrency and len(visited) < max_pages:
+                prio, depth, url, src = heapq.heappop(q)
+                key = canon(url)
+                if key in visited: continue
+                visited.add(key)
+                batch.append((depth, url, src))
+            results = pool.map(polite_fetch, [u for _, u, _ in batch])
+
+            for (depth, url, src), (status, ct, body, err, cond) in zip(batch, results):
+                pref_log_event(pref, {"type":"fetch","url":url,"status":status,"ct":ct,"bytes":len(body) if body else 0,"err":err})
+                # too_large は本文なしで種別だけ記録する（PDFはメタのみ）
+                if status not in (200, 304) or (err and err != "too_large"):
+                    emit(url, depth, src, status, ct, "error")
+                    continue
+
+                kind = classify_ext(url, ct)
+                meta = {"doc_type":kind,"title":"","text_len":0,"years":[],"links":[]}
+                try:
+                    if status == 304:
+                        # 前回から変わっていない：保存済みの解析結果を使う
+                        meta = cond["meta"]
+                    elif body is None and kind != "pdf":
+                        pass
+                    elif kind == "html":
+                        meta = parse_html(body)
+                    elif kind == "xml":
+                        meta = parse_xml(body)
+                    elif kind == "pdf" and body and PDF_POOL is not None:
+                        # 別プロセスで解析し、結果はクロールの最後に回収する（PDFはリンクを辿らない）
+                        fut = PDF_POOL.submit(parse_pdf_quick, url, ct, body)
+                        pending_pdfs.append((fut, url, depth, src, status, ct, cond))
+                        continue
+                    elif kind == "pdf":
+                        meta = parse_pdf_quick(url, ct, body)
+                    else:
+                        # CSV/JSON/XLS等は本文解析しない
+                        pass
+                    if status == 200:
+                        COND.put(COND_NS, url, ct, cond, meta)
+                except Exception as e:
+                    pref_log_event(pref, {"type":"parse_error","url":url,"msg":str(e)})
+
+                emit(url, depth, src, status, ct or "", kind,
+                     meta.get("title",""), meta.get("years",[]) or [], meta.get("text_len",0))
+
+                # 次のリンクをキューへ（HTMLだけ）
+                if depth < max_depth and kind in ("html","xml"):
+                    links = meta.get("links", [])
+                    for href, text in links:
+                        if not href or href.startswith(SKIP_HREF_PREFIXES): continue
+                        full = urljoin(url, href)
+                        if not full.startswith("http"): continue
+                        h = parse_url(full).hostname
+                        if not h or (h != base_host and not (base_is_gojp and h.endswith(".go.jp"))): continue
+                        if canon(full) in visited: continue
+                        p = priority_score(text, full)
+                        heapq.heappush(q, (-(p), depth+1, full, url))
+
+        # 別プロセスに回したPDFの結果を回収して明細へ
+        for fut, url, depth, src, status, ct, cond in pending_pdfs:
+            meta = {"doc_type":"pdf","title":"","text_len":0,"years":[],"links":[]}
+            try:
+                meta = fut.result(timeout=PDF_TIMEOUT)
+                COND.put(COND_NS, url, ct, cond, meta)
+            except Exception as e:
+                pref_log_event(pref, {"type":"parse_error","url":url,"msg":str(e) or type(e).__name__})
+            emit(url, depth, src, status, ct or "", "pdf",
+                 meta.get("title",""), meta.get("years",[]) or [], meta.get("text_len",0))
 
     # 集計
-    counts = defaultdict(int)
-    for r in rows_detail:
-        counts[r["kind"]] += 1
-    latest = max(years_all) if years_all else None
-    earliest = min(years_all) if years_all else None
     coverage_years = (latest - earliest + 1) if (latest and earliest) else 0
 
     # “機械可読”のヒット
     machine_hits = counts["csv"] + counts["json"] + counts["xml"] + counts["xls"]
 
-    # PDFの“テキストPDF”っぽさの比率（text_len>50 を閾値）
-    pdf_texty = sum(1 for r in rows_detail if r["kind"]=="pdf" and r["text_len"]>50)
     pdf_total = counts["pdf"]
     pdf_text_ratio = round(pdf_texty / pdf_total, 2) if pdf_total else 0.0
 
-    pref_log_event(pref, {"type":"end","pref":pref,"pages":len(rows_detail),
+    pref_log_event(pref, {"type":"end","pref":pref,"pages":n_rows,
                           "earliest_year":earliest,"latest_year":latest,
                           "coverage_years":coverage_years,
                           "pdf_text_ratio":pdf_text_ratio,
                           "machine_files":machine_hits})
-    pref_log_txt(pref, f"[END] pages={len(rows_detail)} years={earliest}-{latest} cov={coverage_years} pdf_text={pdf_texty}/{pdf_total}")
+    pref_log_txt(pref, f"[END] pages={n_rows} years={earliest}-{latest} cov={coverage_years} pdf_text={pdf_texty}/{pdf_total}")
+    PLOG.close(safe_name(pref))
 
-    return rows_detail, {
+    return {
         "prefecture": pref,
-        "pages_scanned": len(rows_detail),
+        "pages_scanned": n_rows,
         "earliest_year": earliest,
         "latest_year": latest,
         "coverage_years": coverage_years,
@@ -311,15 +439,21 @@ def introspect_pref(pref: str, start_url: str, max_pages=60, max_depth=2, sleep_
 
 # ========= メイン =========
 def main():
+    global PDF_POOL
     parser = argparse.ArgumentParser()
     parser.add_argument("--pref", type=str, default=None, help="対象都道府県名（未指定なら全件）")
     parser.add_argument("--max-pages", type=int, default=60, help="1県あたり最大取得ページ数")
     parser.add_argument("--max-depth", type=int, default=2, help="リンク深さの最大値")
     parser.add_argument("--workers", type=int, default=4, help="並列数")
-    parser.add_argument("--sleep", type=float, default=0.4, help="取得間隔(秒)")
+    parser.add_argument("--sleep", type=float, default=0.4, help="同一ホストへの取得間隔(秒)")
+    parser.add_argument("--concurrency", type=int, default=3, help="1県内（同一ホスト）の同時取得数")
+    parser.add_argument("--pdf-workers", type=int, default=os.cpu_count() or 1,
+                        help="PDF解析のプロセス数（0ならスレッド内で解析）")
     args = parser.parse_args()
 
     setup_dirs()
+    setup_session(args.workers * args.concurrency)
+    HOSTS.per_host = args.concurrency
     if not INPUT_CSV.exists():
         raise FileNotFoundError(f"not found: {INPUT_CSV}")
 
@@ -329,38 +463,43 @@ def main():
         if not seeds:
             raise SystemExit(f"pref not found in CSV: {args.pref}")
 
-    summaries = []
-    OUT_SUM.write_text("", encoding="utf-8")  # 初回は空ファイルで作る
-
-    with ThreadPoolExecutor(max_workers=args.workers) as ex:
+    sum_fields = [
+        "prefecture","pages_scanned","earliest_year","latest_year","coverage_years",
+        "count_html","count_xml","count_pdf","count_csv","count_json","count_xls","count_other",
+        "pdf_text_ratio","machine_file_hits"
+    ]
+    if args.pdf_workers > 0:
+        # 取得スレッドが動いている最中に fork しないよう spawn で起動する
+        PDF_POOL = ProcessPoolExecutor(max_workers=args.pdf_workers,
+                                       mp_context=multiprocessing.get_context("spawn"))
+
+    # サマリは県が終わるたびに追記する（途中経過がすぐファイルで見える）
+    with OUT_SUM.open("w", newline="", encoding="utf-8") as sum_f, \
+         ThreadPoolExecutor(max_workers=args.workers) as ex:
+        sum_w = csv.DictWriter(sum_f, fieldnames=sum_fields)
+        sum_w.writeheader(); sum_f.flush()
         futs = []
         for r in seeds:
             pref = r["prefecture"].strip()
             url  = r["url"].strip()
-            futs.append(ex.submit(introspect_pref, pref, url, args.max_pages, args.max_depth, args.sleep))
+            futs.append(ex.submit(introspect_pref, pref, url, args.max_pages, args.max_depth, args.sleep, args.concurrency))
 
         for fut in as_completed(futs):
             try:
-                rows_detail, summary = fut.result()
-                # 明細出力
-                inv_path = OUT_DIR / f"{safe_name(summary['prefecture'])}.inventory.csv"
-                with inv_path.open("w", newline="", encoding="utf-8") as f:
-                    w = csv.DictWriter(f, fieldnames=["url","depth","from","status","ctype","kind","title","years","text_len"])
-                    w.writeheader(); w.writerows(rows_detail)
-                # サマリ蓄積
-                summaries.append(summary)
+                # 明細は introspect_pref 内で書き出し済み
+                sum_w.writerow(fut.result()); sum_f.flush()
             except Exception as e:
                 print("worker exception:", e, flush=True)
 
-    # サマリ出力（県名ソート）
-    summaries.sort(key=lambda x: x["prefecture"])
+    if PDF_POOL is not None:
+        PDF_POOL.shutdown()
+
+    # 完了順に書いたので、最後に県名順へ並べ替えて書き直す
+    with OUT_SUM.open(encoding="utf-8", newline="") as f:
+        rows = sorted(csv.DictReader(f), key=lambda x: x["prefecture"])
     with OUT_SUM.open("w", newline="", encoding="utf-8") as f:
-        w = csv.DictWriter(f, fieldnames=[
-            "prefecture","pages_scanned","earliest_year","latest_year","coverage_years",
-            "count_html","count_xml","count_pdf","count_csv","count_json","count_xls","count_other",
-            "pdf_text_ratio","machine_file_hits"
-        ])
-        w.writeheader(); w.writerows(summaries)
+        w = csv.DictWriter(f, fieldnames=sum_fields)
+        w.writeheader(); w.writerows(rows)
 
     print(f"saved: {OUT_SUM}")
     print(f"saved inventories under: {OUT_DIR}")
@@ -1,13 +1,18 @@
 #!/usr/bin/env python3
 # -*- coding: utf-8 -*-
-import argparse, csv, json, queue, re, time
+import argparse, csv, re, time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from functools import lru_cache
 from pathlib import Path
-from urllib.parse import urljoin, urlparse
+from urllib.parse import urljoin
 
 import requests
-from bs4 import BeautifulSoup
-from urllib import robotparser
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 import logging
+
+from common import CondCache, HostLimiter, PrefLogs, RobotsCache, canon, parse_url, html_tree, max_bytes_for, node_text, read_capped
 from datetime import datetime
 
 # --- ここだけ置き換え（冒頭の logging 設定）---
@@ -34,7 +39,7 @@ UA = "agri-forecast-sitemap/0.1"
 TIMEOUT = 20
 
 # 年候補（本文は読まない。アンカー/タイトル/URLからだけ拾う）
-YEAR_PAT  = re.compile(r"(令和\s?\d+|平成\s?\d+|20\d{2})")
+YEAR_PAT  = re.compile(r"令和\s?(?P<r>\d+)|平成\s?(?P<h>\d+)|(?P<c>20\d{2})")
 FUTURE_GUARD_WORDS = ("計画","予定","案","募集","予算","方針","公募")
 
 def setup_dirs():
@@ -45,55 +50,70 @@ def safe_name(s: str) -> str:
     return re.sub(r'[\\/:*?"<>|]', "_", s)
 
 # ---- 県別ログ ----
+PLOG = PrefLogs(LOG_DIR)
+
 def log_txt(pref: str, msg: str):
-    ts = time.strftime("%Y-%m-%d %H:%M:%S")
-    with (LOG_DIR / f"{safe_name(pref)}.log").open("a", encoding="utf-8") as f:
-        f.write(f"[{ts}] {msg}\n")
+    PLOG.text(safe_name(pref), msg)
 
 def log_event(pref: str, ev: dict):
-    ev = {"ts": time.strftime("%Y-%m-%dT%H:%M:%S"), **ev}
-    with (LOG_DIR / f"{safe_name(pref)}.jsonl").open("a", encoding="utf-8") as f:
-        f.write(json.dumps(ev, ensure_ascii=False) + "\n")
-
-# ---- robots.txt ----
-class Robots:
-    def __init__(self): self.cache={}
-    def allowed(self, url:str)->bool:
-        base = urlparse(url).scheme + "://" + urlparse(url).netloc
-        if base not in self.cache:
-            rp = robotparser.RobotFileParser()
-            rp.set_url(urljoin(base, "/robots.txt"))
-            try: rp.read()
-            except Exception: pass
-            self.cache[base] = rp
-        return self.cache[base].can_fetch(UA, url)
-ROBOTS = Robots()
+    PLOG.event(safe_name(pref), ev)
 
 # ---- HTTP ----
+# 同一ドメインへ連続アクセスするので、Session で接続（TCP/TLS）を使い回す
+SESSION = requests.Session()
+SESSION.headers.update({"User-Agent": UA})
+
+ROBOTS = RobotsCache(UA, SESSION, timeout=TIMEOUT)
+HOSTS = HostLimiter()
+COND = CondCache()
+COND_NS = "site_map"
+
+def setup_session(workers:int=1):
+    retry = Retry(total=2, backoff_factor=0.3, status_forcelist=[429,500,502,503,504],
+                  raise_on_status=False)
+    adapter = HTTPAdapter(pool_connections=workers, pool_maxsize=workers*4, max_retries=retry)
+    SESSION.mount("http://", adapter)
+    SESSION.mount("https://", adapter)
+
 def fetch(url:str):
+    # (status, ct, body, err, cond)。cond は 304 なら保存済みエントリ、それ以外は検証子
     if not ROBOTS.allowed(url):
-        return None, None, None, "robots_disallow"
+        return None, None, None, "robots_disallow", None
     try:
-        r = requests.get(url, headers={"User-Agent": UA}, timeout=TIMEOUT, allow_redirects=True)
-        ct = (r.headers.get("Content-Type") or "").lower()
-        return r.status_code, ct, r.content, None
+        cached = COND.get(COND_NS, url)
+        headers = CondCache.headers(cached) if cached else None
+        with SESSION.get(url, timeout=TIMEOUT, allow_redirects=True, stream=True, headers=headers) as r:
+            if r.status_code == 304 and cached:
+                return 304, cached["ct"], None, None, cached
+            ct = (r.headers.get("Content-Type") or "").lower()
+            body = read_capped(r, max_bytes_for(url, ct))
+            if body is None:
+                return r.status_code, ct, None, "too_large", CondCache.validators(r)
+            return r.status_code, ct, body, None, CondCache.validators(r)
     except Exception as e:
-        return None, None, None, str(e)
+        return None, None, None, str(e), None
 
-def is_same_domain(a:str, b:str)->bool:
-    try:
-        A = urlparse(a).netloc.split(":")[0]
-        B = urlparse(b).netloc.split(":")[0]
-        return (A == B) or (A.endswith(".go.jp") and B.endswith(".go.jp"))
-    except: return False
+XLS_EXTS  = (".xlsx",".xls",".xlsm")
+HTML_EXTS = (".html",".htm","/")
 
+@lru_cache(maxsize=256)
+def ct_kind(ct:str):
+    # Content-Type だけで決まる種別（pdf > html > xml の順）。値ごとに覚える
+    if not ct: return None
+    if "pdf" in ct: return "pdf"
+    if "html" in ct: return "html"
+    if "xml" in ct: return "xml"
+    return None
+
+@lru_cache(maxsize=16384)
 def classify(ct:str, url:str)->str:
     u = (url or "").lower()
-    if (ct and "pdf" in ct) or u.endswith(".pdf"): return "pdf"
-    if (ct and ("html" in ct or "xhtml" in ct)) or u.endswith((".html",".htm","/")): return "html"
-    if (ct and "xml" in ct) or u.endswith(".xml"): return "xml"
+    k = ct_kind(ct)
+    if k == "pdf" or u.endswith(".pdf"): return "pdf"
+    if k == "html" or u.endswith(HTML_EXTS): return "html"
+    if k == "xml" or u.endswith(".xml"): return "xml"
     if u.endswith(".csv"): return "csv"
-    if u.endswith((".xlsx",".xls",".xlsm")): return "xls"
+    if u.endswith(XLS_EXTS): return "xls"
     if u.endswith(".json"): return "json"
     return "other"
 
@@ -101,21 +121,14 @@ def extract_years_from_text(s:str):
     if not s: return []
     s = s.replace("　"," ")
     years=[]
-    for m in YEAR_PAT.findall(s):
-        token=m.strip()
-        y=None
-        if token.startswith("令和"):
-            try: y = 2018 + int(re.sub(r"\D","",token))  # 令和1=2019
-            except: pass
-        elif token.startswith("平成"):
-            try: y = 1988 + int(re.sub(r"\D","",token))  # 平成1=1989
-            except: pass
-        else:
-            try: y=int(re.search(r"20\d{2}",token).group(0))
-            except: pass
-        if not y: continue
+    current_year = time.localtime().tm_year
+    for m in YEAR_PAT.finditer(s):
+        r, h, c = m.group("r", "h", "c")
+        if r:   y = 2018 + int(r)  # 令和1=2019
+        elif h: y = 1988 + int(h)  # 平成1=1989
+        else:   y = int(c)
         # 未来年は除外
-        if y > time.localtime().tm_year: continue
+        if y > current_year: continue
         years.append(y)
     # ユニーク化・降順
     return sorted(set(years), reverse=True)
@@ -124,27 +137,28 @@ def parse_html_for_links(base_url:str, html_bytes:bytes):
     # HTMLのタイトル・h1・リンク群（PDF含む）だけ抽出
     try: html = html_bytes.decode("utf-8", errors="ignore")
     except: html = html_bytes.decode("cp932", errors="ignore")
-    soup = BeautifulSoup(html, "lxml")
-    title = (soup.title.get_text(strip=True) if soup.title else "")
-    h1 = (soup.select_one("h1").get_text(strip=True) if soup.select_one("h1") else "")
-    anchors=[]
-    for a in soup.select("a[href]"):
-        href = a.get("href",""); text = a.get_text(" ", strip=True)
-        full = urljoin(base_url, href)
-        anchors.append((full, text))
+    tree = html_tree(html)
+    if tree is None: return "", "", []
+    t = tree.find(".//title")
+    title = (node_text(t, "") if t is not None else "")
+    h = tree.find(".//h1")
+    h1 = (node_text(h, "") if h is not None else "")
+    anchors = [(urljoin(base_url, a.get("href","")), node_text(a)) for a in tree.xpath("//a[@href]")]
     return title, h1, anchors
 
+@lru_cache(maxsize=16384)
 def section_key(url:str, levels:int=2):
     # ドメイン以降のパス先頭n階層で粗く分類
-    p = urlparse(url).path.strip("/")
+    p = parse_url(url).path.strip("/")
     parts = [x for x in p.split("/") if x]
     return "/".join(parts[:levels]) if parts else ""
 
+@lru_cache(maxsize=16384)
 def filename_of(url:str):
-    p = urlparse(url).path
+    p = parse_url(url).path
     return p.split("/")[-1] if p else ""
 
-def map_pref(pref:str, start_url:str, max_pages=80, max_depth=2, sleep=0.3):
+def map_pref(pref:str, start_url:str, max_pages=80, max_depth=2, sleep=0.3, concurrency=3):
     # 県ごとのファイルロガー
     pref_logger = logging.getLogger(f"crawl.{pref}")
     pref_logger.setLevel(logging.INFO)
@@ -161,111 +175,115 @@ def map_pref(pref:str, start_url:str, max_pages=80, max_depth=2, sleep=0.3):
     log_event(pref, {"type":"start","pref":pref,"url":start_url})
     pref_logger.info(f"START {pref} url={start_url} depth<= {max_depth} pages<= {max_pages}")
 
-    visited=set()
-    q=queue.Queue()
-    q.put((0, start_url, None))  # (depth, url, parent)
+    # ドメイン制限（同一ホスト、または起点が .go.jp なら .go.jp 同士は同一扱い）
+    base_host = (parse_url(start_url).hostname or "").lower()
+    base_is_gojp = base_host.endswith(".go.jp")
 
-    pages=[]
-    pdf_rows=[]
-    sections_count={}
+    visited=set()  # canon() 済みのURLキー
+    q=deque()  # この県のスレッドだけが触るのでロック不要
+    q.append((0, start_url, None))  # (depth, url, parent)
 
-    while not q.empty() and len(visited) < max_pages:
-        depth, url, parent = q.get()
-        if url in visited:
-            continue
-        visited.add(url)
-
-        progress = f"{len(visited)}/{len(visited) + q.qsize()}"
-        pref_logger.info(f"[{progress}] GET depth={depth} url={url}")
-
-        time.sleep(sleep)
-        status, ct, body, err = fetch(url)
-        size = (len(body) if body else 0)
-        kind = classify(ct or "", url)
-        pref_logger.info(f" -> status={status} ct={ct} kind={kind} bytes={size} err={err or ''}")
-        log_event(pref, {"type":"fetch","url":url,"status":status,"ct":ct,"bytes":size,"err":err})
-
-        title = h1 = ""
-        n_links = n_pdf = 0
-
-        if status == 200 and body and kind == "html":
-            title, h1, anchors = parse_html_for_links(url, body)
-            pref_logger.info(f" parse html: title='{(title or '')[:60]}' links={len(anchors)}")
-
-            # 内部リンクを走査
-            shown = 0
-            for full, text in anchors:
-                if not full.startswith("http"):
-                    continue
-                if not is_same_domain(start_url, full):
-                    continue
-
-                if full.lower().endswith(".pdf"):
-                    n_pdf += 1
-                    years = extract_years_from_text(f"{text} {title} {full}")
-                    pdf_rows.append({
-                        "prefecture": pref,
-                        "source_page": url,
-                        "depth": depth,
-                        "pdf_url": full,
-                        "anchor_text": text,
-                        "filename": filename_of(full),
-                        "years": "|".join(map(str, years)) if years else ""
-                    })
-                    if shown < 10:
-                        pref_logger.info(f"   [pdf] {full}  anchor='{(text or '')[:50]}' years={years or []}")
-                        shown += 1
-                    continue  # PDFは辿らない
-
-                n_links += 1
-                if depth < max_depth:
-                    q.put((depth+1, full, url))
-                    if shown < 10:
-                        pref_logger.info(f"   [link] -> depth={depth+1} {full}")
-                        shown += 1
-            if len(anchors) > shown:
-                pref_logger.info(f"   ... more {len(anchors)-shown} links omitted ...")
-
-        pages.append({
-            "prefecture": pref,
-            "url": url,
-            "depth": depth,
-            "parent": parent or "",
-            "status": status if status is not None else "",
-            "ctype": ct or "",
-            "kind": kind,
-            "title": title,
-            "h1": h1,
-            "section": section_key(url, levels=2),
-            "n_out_links": n_links,
-            "n_pdf_links": n_pdf
-        })
-
-        sk = pages[-1]["section"]
-        sections_count[sk] = sections_count.get(sk, 0) + 1
-
-    # 出力
+    # pages/pdfs は取得しながらCSVへ流す（行はメモリに溜めない）
     out_pages   = OUT_DIR / f"{safe_name(pref)}.pages.csv"
     out_pdfs    = OUT_DIR / f"{safe_name(pref)}.pdfs.csv"
     out_sections= OUT_DIR / f"{safe_name(pref)}.sections.csv"
+    pages_f = open(out_pages, "w", newline="", encoding="utf-8", buffering=1 << 20)
+    pdfs_f  = open(out_pdfs, "w", newline="", encoding="utf-8", buffering=1 << 20)
+    pages_w = csv.writer(pages_f)
+    pdfs_w  = csv.writer(pdfs_f)
+    pages_w.writerow(["prefecture","url","depth","parent","status","ctype","kind","title","h1","section","n_out_links","n_pdf_links"])
+    pdfs_w.writerow(["prefecture","source_page","depth","pdf_url","anchor_text","filename","years"])
+    n_pages = n_pdfs = 0
+    sections_count={}
 
-    with out_pages.open("w", newline="", encoding="utf-8") as f:
-        w = csv.DictWriter(f, fieldnames=["prefecture","url","depth","parent","status","ctype","kind","title","h1","section","n_out_links","n_pdf_links"])
-        w.writeheader(); w.writerows(pages)
-
-    with out_pdfs.open("w", newline="", encoding="utf-8") as f:
-        w = csv.DictWriter(f, fieldnames=["prefecture","source_page","depth","pdf_url","anchor_text","filename","years"])
-        w.writeheader(); w.writerows(pdf_rows)
-
+    def polite_fetch(url):
+        with HOSTS.slot(url):
+            HOSTS.wait(url, sleep)
+            return fetch(url)
+
+    with pages_f, pdfs_f, ThreadPoolExecutor(max_workers=concurrency) as pool:
+        while q and len(visited) < max_pages:
+            # キューから同時取得数ぶん取り出してまとめて取得（キュー操作はこのスレッドだけ）
+            batch = []
+            while q and len(batch) < concurrency and len(visited) < max_pages:
+                depth, url, parent = q.popleft()
+                key = canon(url)
+                if key in visited:
+                    continue
+                visited.add(key)
+
+                progress = f"{len(visited)}/{len(visited) + len(q)}"
+                pref_logger.info(f"[{progress}] GET depth={depth} url={url}")
+                batch.append((depth, url, parent))
+            results = pool.map(polite_fetch, [u for _, u, _ in batch])
+
+            for (depth, url, parent), (status, ct, body, err, cond) in zip(batch, results):
+                size = (len(body) if body else 0)
+                kind = classify(ct or "", url)
+                pref_logger.info(f" -> status={status} ct={ct} kind={kind} bytes={size} err={err or ''}")
+                log_event(pref, {"type":"fetch","url":url,"status":status,"ct":ct,"bytes":size,"err":err})
+
+                title = h1 = ""
+                n_links = n_pdf = 0
+
+                anchors = None
+                if status == 304 and kind == "html":
+                    # 前回から変わっていない：保存済みの解析結果を使う
+                    m = cond["meta"]
+                    title, h1, anchors = m["title"], m["h1"], m["anchors"]
+                elif status == 200 and body and kind == "html":
+                    title, h1, anchors = parse_html_for_links(url, body)
+                    COND.put(COND_NS, url, ct, cond, {"title": title, "h1": h1, "anchors": anchors})
+
+                if anchors is not None:
+                    pref_logger.info(f" parse html: title='{(title or '')[:60]}' links={len(anchors)}")
+
+                    # 内部リンクを走査
+                    shown = 0
+                    for full, text in anchors:
+                        if not full.startswith("http"):
+                            continue
+                        h = parse_url(full).hostname
+                        if not h or (h != base_host and not (base_is_gojp and h.endswith(".go.jp"))):
+                            continue
+
+                        if full.lower().endswith(".pdf"):
+                            n_pdf += 1
+                            years = extract_years_from_text(f"{text} {title} {full}")
+                            pdfs_w.writerow([pref, url, depth, full, text, filename_of(full),
+                                             "|".join(map(str, years)) if years else ""])
+                            n_pdfs += 1
+                            if shown < 10:
+                                pref_logger.info(f"   [pdf] {full}  anchor='{(text or '')[:50]}' years={years or []}")
+                                shown += 1
+                            continue  # PDFは辿らない
+
+                        n_links += 1
+                        if depth < max_depth:
+                            q.append((depth+1, full, url))
+                            if shown < 10:
+                                pref_logger.info(f"   [link] -> depth={depth+1} {full}")
+                                shown += 1
+                    if len(anchors) > shown:
+                        pref_logger.info(f"   ... more {len(anchors)-shown} links omitted ...")
+
+                sk = section_key(url, levels=2)
+                pages_w.writerow([pref, url, depth, parent or "", status if status is not None else "",
+                                  ct or "", kind, title, h1, sk, n_links, n_pdf])
+                n_pages += 1
+                sections_count[sk] = sections_count.get(sk, 0) + 1
+
+    # 出力（セクション集計）
     with out_sections.open("w", newline="", encoding="utf-8") as f:
         w = csv.DictWriter(f, fieldnames=["prefecture","section","pages"])
         w.writeheader()
         for k,v in sorted(sections_count.items(), key=lambda x:(x[0] or "zzz")):
             w.writerow({"prefecture":pref,"section":k,"pages":v})
 
-    log_event(pref, {"type":"end","pref":pref,"pages":len(pages),"pdfs":len(pdf_rows)})
-    log_txt(pref, f"[END] pages={len(pages)} pdfs={len(pdf_rows)}")
-    pref_logger.info(f"DONE pages={len(pages)} pdfs={len(pdf_rows)} visited={len(visited)} queued={q.qsize()}")
+    log_event(pref, {"type":"end","pref":pref,"pages":n_pages,"pdfs":n_pdfs})
+    log_txt(pref, f"[END] pages={n_pages} pdfs={n_pdfs}")
+    PLOG.close(safe_name(pref))
+    pref_logger.info(f"DONE pages={n_pages} pdfs={n_pdfs} visited={len(visited)} queued={len(q)}")
     pref_logger.info(f"Wrote: {out_pages.name}, {out_pdfs.name}, {out_sections.name}")
     print(f"saved: {out_pages}")
     print(f"saved: {out_pdfs}")
@@ -277,10 +295,14 @@ def main():
     parser.add_argument("--pref", type=str, default=None, help="対象都道府県名（未指定なら全件）")
     parser.add_argument("--max-pages", type=int, default=80)
     parser.add_argument("--max-depth", type=int, default=2)
-    parser.add_argument("--sleep", type=float, default=0.3)
+    parser.add_argument("--sleep", type=float, default=0.3, help="同一ホストへの取得間隔(秒)")
+    parser.add_argument("--workers", type=int, default=4, help="並列に処理する県の数")
+    parser.add_argument("--concurrency", type=int, default=3, help="1県内（同一ホスト）の同時取得数")
     args = parser.parse_args()
 
     setup_dirs()
+    setup_session(args.workers * args.concurrency)
+    HOSTS.per_host = args.concurrency
     if not SEEDS_CSV.exists():
         raise FileNotFoundError(f"not found: {SEEDS_CSV}")
 
@@ -289,11 +311,21 @@ def main():
         seeds = [r for r in seeds if r["prefecture"] == args.pref]
         if not seeds: raise SystemExit(f"pref not found: {args.pref}")
 
-    for r in seeds:
-        pref = r["prefecture"].strip()
-        url  = r["url"].strip()
-        print(f"[START] {pref} … {url}")
-        map_pref(pref, url, max_pages=args.max_pages, max_depth=args.max_depth, sleep=args.sleep)
+    # 県ごとにホストが異なるので、県単位で並列に回す（同一ホストの制限は HOSTS が担う）
+    with ThreadPoolExecutor(max_workers=args.workers) as ex:
+        futs = []
+        for r in seeds:
+            pref = r["prefecture"].strip()
+            url  = r["url"].strip()
+            print(f"[START] {pref} … {url}")
+            futs.append(ex.submit(map_pref, pref, url, max_pages=args.max_pages, max_depth=args.max_depth,
+                                  sleep=args.sleep, concurrency=args.concurrency))
+
+        for fut in as_completed(futs):
+            try:
+                fut.result()
+            except Exception as e:
+                print("worker exception:", e, flush=True)
 
 if __name__ == "__main__":
     main()
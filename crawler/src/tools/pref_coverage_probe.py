@@ -15,17 +15,29 @@ pref_coverage_probe.py
 """
 
 import argparse
+import atexit
 import csv
 import json
+import multiprocessing
+import os
 import re
+import threading
 import time
-from concurrent.futures import ThreadPoolExecutor, as_completed
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, ThreadPoolExecutor, wait
+from datetime import datetime
 from pathlib import Path
 from urllib.parse import urljoin, urlparse
 
 import requests
-from bs4 import BeautifulSoup
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 from dateutil import parser as dateparser
+from lxml import etree
+from lxml import html as lxml_html
+try:
+    import orjson  # あれば JSONL ログを C 実装で直接 bytes にする
+except ImportError:
+    orjson = None
 
 # ================== 設定（ルートから実行前提） ==================
 INPUT_CSV = Path("data/processed/pref_boujosho_links.csv")
@@ -34,15 +46,20 @@ BY_PREF   = Path("logs/by_pref")
 
 UA = "agri-forecast-probe/0.2"
 TIMEOUT = 20
+PER_HOST = 2          # 同一ホストへの同時リクエスト数
+HOST_INTERVAL = 0.4   # 同一ホストへのリクエスト開始間隔（秒）
+MAX_BYTES = 2_000_000 # 本文はここまでしか読まない（年抽出は先頭 8000 字しか使わない）
 
 # 予察関連のヒット指標
 KEYWORDS  = ["予察", "発生予察", "発生情報", "注意報", "警報", "バックナンバー", "年度"]
 URL_HINTS = ["yosatsu", "yosatu", "yohou", "byogaichu", "gaicyu", "gaichu"]
 
-# 年・年度の抽出用（和暦/西暦）
-YEAR_PAT = re.compile(r"(令和\s?\d+年度?|平成\s?\d+年度?|20\d{2}(?:年度?)?)")
+# 年・年度の抽出用（和暦/西暦）。数字は名前付きグループで直接取り出す
+YEAR_PAT = re.compile(r"令和\s?(?P<r>\d+)年度?|平成\s?(?P<h>\d+)年度?|(?P<c>20\d{2})(?:年度?)?")
 # 将来系語の近傍に出る年は除外（例: 来年度計画）
 FUTURE_GUARD_WORDS = ("計画", "予定", "案", "募集", "予算", "方針")
+GUARD_RE = re.compile("|".join(map(re.escape, FUTURE_GUARD_WORDS)))
+UNSAFE_CHARS_RE = re.compile(r'[\\/:*?"<>|]')
 
 # ================== ユーティリティ ==================
 def setup_dirs():
@@ -50,28 +67,137 @@ def setup_dirs():
     BY_PREF.mkdir(parents=True, exist_ok=True)
 
 def safe_name(name: str) -> str:
-    return re.sub(r'[\\/:*?"<>|]', "_", name)
+    return UNSAFE_CHARS_RE.sub("_", name)
+
+# 県ごとの .log / .jsonl は1回だけ開いて書き続ける（イベントごとに open/close しない）
+_LOG_HANDLES = {}  # (県名, 拡張子) -> file
+_LOG_LOCK = threading.Lock()
+
+def _log_fh(pref: str, ext: str):
+    key = (pref, ext)
+    fh = _LOG_HANDLES.get(key)
+    if fh is None:
+        with _LOG_LOCK:
+            fh = _LOG_HANDLES.get(key)
+            if fh is None:
+                p = BY_PREF / f"{safe_name(pref)}{ext}"
+                if ext == ".jsonl":  # JSONL は bytes のまま書く
+                    fh = p.open("ab", buffering=1 << 16)
+                else:
+                    fh = p.open("a", encoding="utf-8", buffering=1 << 16)
+                _LOG_HANDLES[key] = fh
+    return fh
 
 def log_pref_text(pref: str, msg: str):
     ts = time.strftime("%Y-%m-%d %H:%M:%S")
-    p = BY_PREF / f"{safe_name(pref)}.log"
-    with p.open("a", encoding="utf-8") as f:
-        f.write(f"[{ts}] {msg}\n")
+    _log_fh(pref, ".log").write(f"[{ts}] {msg}\n")
 
 def log_pref_event(pref: str, event: dict):
     event = {"ts": time.strftime("%Y-%m-%dT%H:%M:%S"), **event}
-    p = BY_PREF / f"{safe_name(pref)}.jsonl"
-    with p.open("a", encoding="utf-8") as f:
-        f.write(json.dumps(event, ensure_ascii=False) + "\n")
+    if orjson is not None:
+        line = orjson.dumps(event, option=orjson.OPT_APPEND_NEWLINE)
+    else:
+        line = (json.dumps(event, ensure_ascii=False) + "\n").encode("utf-8")
+    _log_fh(pref, ".jsonl").write(line)
+
+def close_pref_logs(pref: str = None):
+    """県の処理が終わったら閉じる。pref 未指定なら全部（プロセス終了時の閉じ忘れ対策）"""
+    with _LOG_LOCK:
+        for key in [k for k in _LOG_HANDLES if pref is None or k[0] == pref]:
+            _LOG_HANDLES.pop(key).close()
+
+atexit.register(close_pref_logs)
+
+# ================== HTTP ==================
+# 接続（TCP+TLS）を使い回す。全スレッドで1つのセッションを共有する
+SESSION = requests.Session()
+SESSION.headers.update({"User-Agent": UA})
+
+def setup_session(workers: int):
+    """県ワーカー×ホスト同時数に合わせて接続プールを確保し、一時的な失敗は軽くリトライ"""
+    retry = Retry(total=3, backoff_factor=0.3, status_forcelist=[502, 503, 504],
+                  raise_on_status=False)
+    adapter = HTTPAdapter(pool_connections=workers, pool_maxsize=workers * (PER_HOST + 1),
+                          max_retries=retry)
+    SESSION.mount("http://", adapter)
+    SESSION.mount("https://", adapter)
+
+class HostGate:
+    """同一ホストへの同時数と開始間隔を制限する（別ホストどうしは待たない。県をまたいで共有）"""
+    def __init__(self, per_host: int, interval: float):
+        self.per_host = per_host
+        self.interval = interval
+        self._sems = {}
+        self._next = {}  # host -> 次に開始してよい時刻（monotonic）
+        self._lock = threading.Lock()
+
+    def slot(self, host: str) -> threading.BoundedSemaphore:
+        with self._lock:
+            sem = self._sems.get(host)
+            if sem is None:
+                sem = self._sems[host] = threading.BoundedSemaphore(self.per_host)
+        return sem
+
+    def wait(self, host: str):
+        # 枠はロック内で予約し、スリープはロックの外で行う
+        with self._lock:
+            now = time.monotonic()
+            start = max(now, self._next.get(host, 0.0))
+            self._next[host] = start + self.interval
+        if start > now:
+            time.sleep(start - now)
+
+HOSTS = HostGate(PER_HOST, HOST_INTERVAL)
 
 def fetch(url: str):
+    """
+    (status, ct, body) を返す。PDF は parse_pdf_quick が本文を見ないのでヘッダだけで打ち切り、
+    それ以外も MAX_BYTES で切り詰める（巨大ファイルでスレッドが止まらないように）
+    """
     try:
-        r = requests.get(url, headers={"User-Agent": UA}, timeout=TIMEOUT)
-        ct = r.headers.get("Content-Type", "").lower()
-        return r.status_code, ct, r.content
+        with SESSION.get(url, timeout=TIMEOUT, stream=True) as r:
+            ct = r.headers.get("Content-Type", "").lower()
+            if "pdf" in ct or url.lower().endswith(".pdf"):
+                return r.status_code, ct, b""
+            chunks, total = [], 0
+            for chunk in r.iter_content(65536):
+                chunks.append(chunk)
+                total += len(chunk)
+                if total >= MAX_BYTES:
+                    break
+            return r.status_code, ct, b"".join(chunks)[:MAX_BYTES]
     except Exception:
         return None, None, None
 
+# ================== lxml ==================
+_tls = threading.local()
+
+def _parsers():
+    # lxml のパーサはスレッド間で共有できないので、ワーカースレッドごとに1組だけ作って使い回す
+    ps = getattr(_tls, "parsers", None)
+    if ps is None:
+        ps = _tls.parsers = (
+            # 従来の utf-8 決め打ちデコードと同じ扱い（不正バイトは置換文字になる）
+            lxml_html.HTMLParser(recover=True, encoding="utf-8", remove_comments=True, remove_pis=True),
+            etree.XMLParser(recover=True, remove_comments=True, remove_pis=True, resolve_entities=False),
+        )
+    return ps
+
+def html_root(content_bytes: bytes):
+    """bytes を直接 libxml2 に渡して木を作る（decode しない）。空・解析不能なら None"""
+    if not content_bytes or not content_bytes.strip():
+        return None
+    try:
+        root = lxml_html.document_fromstring(content_bytes, parser=_parsers()[0])
+    except (etree.ParserError, ValueError):
+        return None
+    etree.strip_elements(root, "script", "style", with_tail=False)
+    return root
+
+def node_text(el, sep: str = " ") -> str:
+    """BeautifulSoup の get_text(sep, strip=True) 相当"""
+    return sep.join(t.strip() for t in el.itertext() if t.strip())
+
 def is_same_domain(base: str, link: str) -> bool:
     try:
         b = urlparse(base).netloc.split(":")[0]
@@ -81,13 +207,15 @@ def is_same_domain(base: str, link: str) -> bool:
         return False
 
 # ================== 抽出・解析 ==================
-def extract_links(base_url: str, html: str):
+def extract_links(base_url: str, content_bytes: bytes):
     """トップページから1階層目の予察系リンクを抽出"""
-    soup = BeautifulSoup(html, "lxml")
+    root = html_root(content_bytes)
+    if root is None:
+        return []
     hits = []
-    for a in soup.select("a[href]"):
+    for a in root.xpath("//a[@href]"):
         href = a.get("href", "")
-        text = a.get_text(" ", strip=True)
+        text = node_text(a)
         full = urljoin(base_url, href)
         if not is_same_domain(base_url, full):
             continue
@@ -101,35 +229,38 @@ def extract_links(base_url: str, html: str):
             out.append(h)
     return out
 
+def parse_meta_time(val: str):
+    """公開日メタの日時。ほぼ ISO 8601 なので fromisoformat を先に試し、だめなら dateutil"""
+    val = val.strip()
+    try:
+        return datetime.fromisoformat(val)
+    except ValueError:
+        try:
+            return dateparser.parse(val, fuzzy=True)
+        except Exception:
+            return None
+
 def extract_year_candidates(text: str):
     """本文・タイトルから年/年度候補を抽出（今年より未来は除外。将来系近傍は除外）"""
     text = text.replace("　", " ")
     current_year = time.localtime().tm_year
     cand = []
 
+    n_text = len(text)
     for m in YEAR_PAT.finditer(text):
-        token = m.group(0).strip()
-        y = None
-        if token.startswith("令和"):
-            n = int(re.sub(r"\D", "", token))
-            y = 2018 + n  # 令和1=2019
-        elif token.startswith("平成"):
-            n = int(re.sub(r"\D", "", token))
-            y = 1988 + n  # 平成1=1989
+        r, h, c = m.group("r", "h", "c")
+        if r:
+            y = 2018 + int(r)  # 令和1=2019
+        elif h:
+            y = 1988 + int(h)  # 平成1=1989
         else:
-            num = re.search(r"20\d{2}", token)
-            if num:
-                y = int(num.group(0))
+            y = int(c)
 
-        if not y:
-            continue
         if y > current_year:
             continue  # 未来年は除外
 
-        start = max(0, m.start() - 20)
-        end = min(len(text), m.end() + 20)
-        near = text[start:end]
-        if any(w in near for w in FUTURE_GUARD_WORDS):
+        # 前後20文字に将来系語があれば除外（部分文字列を作らず範囲指定で検索）
+        if GUARD_RE.search(text, max(0, m.start() - 20), min(n_text, m.end() + 20)):
             continue  # 将来系文脈の年は除外
 
         if 1990 <= y <= current_year:
@@ -139,28 +270,25 @@ def extract_year_candidates(text: str):
 
 def parse_html(content_bytes: bytes):
     """HTML: 公開日メタ優先で年を1つ採用。無ければ本文から候補抽出"""
-    try:
-        html = content_bytes.decode("utf-8", errors="ignore")
-    except Exception:
-        html = content_bytes.decode("cp932", errors="ignore")
-    soup = BeautifulSoup(html, "lxml")
+    root = html_root(content_bytes)
+    if root is None:
+        return {"doc_type": "html", "title": "", "text_len": 0, "years": []}
 
     meta_time = None
-    for sel, attr in [
-        ('meta[property="article:published_time"]', "content"),
-        ('meta[property="og:updated_time"]', "content"),
-        ('time[datetime]', "datetime"),
-    ]:
-        tag = soup.select_one(sel)
-        if tag and tag.get(attr):
-            try:
-                meta_time = dateparser.parse(tag.get(attr), fuzzy=True)
+    for xp in (
+        '//meta[@property="article:published_time"]/@content',
+        '//meta[@property="og:updated_time"]/@content',
+        '//time[@datetime]/@datetime',
+    ):
+        val = root.xpath(xp)[:1]
+        if val and val[0]:
+            meta_time = parse_meta_time(val[0])
+            if meta_time:
                 break
-            except Exception:
-                pass
 
-    title = (soup.title.get_text(strip=True) if soup.title else "")[:200]
-    body = " ".join(x.get_text(" ", strip=True) for x in soup.select("h1,h2,h3,p,li"))[:8000]
+    t = root.find(".//title")
+    title = (node_text(t, "") if t is not None else "")[:200]
+    body = " ".join(node_text(x) for x in root.xpath("//h1|//h2|//h3|//p|//li"))[:8000]
 
     if meta_time:
         years = [meta_time.year]
@@ -172,13 +300,15 @@ def parse_html(content_bytes: bytes):
 def parse_xml(content_bytes: bytes):
     """XML: XMLモードでパースしてテキストを素朴抽出→年候補"""
     try:
-        xml = content_bytes.decode("utf-8", errors="ignore")
-    except Exception:
-        xml = content_bytes.decode("cp932", errors="ignore")
-    soup = BeautifulSoup(xml, "lxml-xml")  # XMLモード
-    title = (soup.title.get_text(strip=True) if soup.title else "")[:200]
+        root = etree.fromstring(content_bytes, parser=_parsers()[1])
+    except (etree.XMLSyntaxError, ValueError):
+        root = None
+    if root is None:
+        return {"doc_type": "xml", "title": "", "text_len": 0, "years": []}
+    t = next(root.iter("{*}title"), None)  # 名前空間つきでもタイトルを拾う
+    title = (node_text(t, "") if t is not None else "")[:200]
     # XMLはタグ名様々なので、テキスト全体から軽く拾う
-    body = soup.get_text(" ", strip=True)[:8000]
+    body = node_text(root)[:8000]
     years = extract_year_candidates(title + " " + body)
     return {"doc_type": "xml", "title": title, "text_len": len(body), "years": years}
 
@@ -186,6 +316,18 @@ def parse_pdf_quick(_content_bytes: bytes):
     """軽量版: PDF本文は読まない（必要になれば pdfminer を追加）"""
     return {"doc_type": "pdf", "title": "", "text_len": 0, "years": []}
 
+def parse_dispatch(content_bytes: bytes, ct: str, url: str):
+    """コンテンツタイプと拡張子でルーティング（プロセスプールに渡すので bytes と文字列だけ受け取る）"""
+    u = url.lower()
+    if (ct and "pdf" in ct) or u.endswith(".pdf"):
+        return parse_pdf_quick(content_bytes)
+    if (ct and "xml" in ct) or u.endswith(".xml"):
+        return parse_xml(content_bytes)
+    return parse_html(content_bytes)
+
+# HTML/XML解析（CPU処理）を回すプロセスプール。main() で作る。None ならその場で解析
+PARSE_POOL = None
+
 # ================== スコアリング ==================
 def score_pref(records: list):
     years = []
@@ -233,79 +375,80 @@ def score_pref(records: list):
     }
 
 # ================== 県ごとの処理 ==================
+def fetch_polite(url: str):
+    host = urlparse(url).netloc
+    with HOSTS.slot(host):
+        HOSTS.wait(host)
+        return fetch(url)
+
 def process_pref(pref: str, url: str, max_follow: int):
     print(f"[SCAN] {pref} … {url}", flush=True)  # 進捗表示
     log_pref_text(pref, f"[START] {pref} {url}")
     log_pref_event(pref, {"type": "pref_start", "pref": pref, "url": url})
 
-    code, ct, content = fetch(url)
+    code, ct, content = fetch_polite(url)
     if code != 200 or content is None:
         log_pref_text(pref, f"[ERROR] root fetch failed status={code}")
         log_pref_event(pref, {"type": "error", "stage": "root_fetch", "status": code})
+        close_pref_logs(pref)
         return pref, {"latest_year": None, "earliest_year": None, "hits_3y": 0,
                       "html_ratio": 0.0, "has_backnumber": 0, "score10": 0.0}, ""
 
-    root_html = ""
-    if ct and ("text/html" in ct or "application/xhtml" in ct):
-        try:
-            root_html = content.decode("utf-8", errors="ignore")
-        except Exception:
-            root_html = content.decode("cp932", errors="ignore")
-
-    links = extract_links(url, root_html) if root_html else []
+    is_html = bool(ct) and ("text/html" in ct or "application/xhtml" in ct)
+    links = extract_links(url, content) if is_html else []
     links = links[:max_follow]
 
-    records = []
-    for lk in links:
-        time.sleep(0.4)  # レート制御
-        u = lk["url"]
-        title_hint = lk["title"]
-        code2, ct2, content2 = fetch(u)
-        log_pref_event(pref, {"type": "fetch", "url": u, "status": code2, "ct": ct2,
-                              "bytes": len(content2) if content2 else 0})
-        if code2 != 200 or content2 is None:
-            continue
-
-        # コンテンツタイプと拡張子でルーティング
-        is_pdf = (ct2 and "pdf" in ct2) or u.lower().endswith(".pdf")
-        is_xml = (ct2 and "xml" in ct2) or u.lower().endswith(".xml")
-
-        if is_pdf:
-            meta = parse_pdf_quick(content2)
-        elif is_xml:
-            meta = parse_xml(content2)
-        else:
-            meta = parse_html(content2)
+    # リンク先はホスト単位のレート制御つきで並行取得し、届いた順（=リンク順）に解析へ回す
+    parsed = []  # (リンク, 解析結果 or Future)
+    with ThreadPoolExecutor(max_workers=PER_HOST) as ex:
+        fetched = ex.map(fetch_polite, [lk["url"] for lk in links])
+        for lk, (code2, ct2, content2) in zip(links, fetched):
+            u = lk["url"]
+            log_pref_event(pref, {"type": "fetch", "url": u, "status": code2, "ct": ct2,
+                                  "bytes": len(content2) if content2 else 0})
+            if code2 != 200 or content2 is None:
+                continue
+            if PARSE_POOL is not None:
+                # 解析は別プロセスで進め、その間に次の取得を待つ
+                parsed.append((lk, PARSE_POOL.submit(parse_dispatch, content2, ct2, u)))
+            else:
+                parsed.append((lk, parse_dispatch(content2, ct2, u)))
 
+    records = []
+    for lk, meta in parsed:
+        if PARSE_POOL is not None:
+            meta = meta.result()
         if not meta.get("title"):
-            meta["title"] = title_hint
-        meta["url"] = u
+            meta["title"] = lk["title"]
+        meta["url"] = lk["url"]
         records.append(meta)
 
     score = score_pref(records)
     samples = ";".join([r.get("url", "") for r in records[:3]])
     log_pref_event(pref, {"type": "pref_end", "pref": pref, **score, "samples": samples})
     log_pref_text(pref, f"[END] score={score['score10']} hits_3y={score['hits_3y']} latest={score['latest_year']}")
+    close_pref_logs(pref)
     return pref, score, samples
 
 # ================== エントリポイント ==================
 def main():
+    global PARSE_POOL
     parser = argparse.ArgumentParser()
     parser.add_argument("--max-per-pref", type=int, default=20, help="各県フォロー数上限")
     parser.add_argument("--workers", type=int, default=4, help="並列数")
+    parser.add_argument("--parse-workers", type=int, default=os.cpu_count() or 1,
+                        help="HTML/XML解析のプロセス数（0ならスレッド内で解析）")
     args = parser.parse_args()
 
     setup_dirs()
+    setup_session(args.workers)
     if not INPUT_CSV.exists():
         raise FileNotFoundError(f"not found: {INPUT_CSV}")
 
-    rows = list(csv.DictReader(INPUT_CSV.open(encoding="utf-8")))
     results = []
 
-    with ThreadPoolExecutor(max_workers=args.workers) as ex:
-        futures = [ex.submit(process_pref, r["prefecture"].strip(), r["url"].strip(), args.max_per_pref)
-                   for r in rows]
-        for fut in as_completed(futures):
+    def collect(done):
+        for fut in done:
             try:
                 pref, score, samples = fut.result()
                 results.append({
@@ -317,6 +460,24 @@ def main():
                 # 各県内の例外は県別JSONLに出ているはずなのでここでは表示のみ
                 print("worker exception:", e, flush=True)
 
+    if args.parse_workers > 0:
+        # 取得スレッドが動いている最中に fork しないよう spawn で起動する
+        PARSE_POOL = ProcessPoolExecutor(max_workers=args.parse_workers,
+                                         mp_context=multiprocessing.get_context("spawn"))
+
+    # CSV を読みながら投入し、未完了が一定数を超えたら1件終わるまで待つ（投入待ちを溜め込まない）
+    with INPUT_CSV.open(encoding="utf-8") as f, ThreadPoolExecutor(max_workers=args.workers) as ex:
+        pending = set()
+        for r in csv.DictReader(f):
+            if len(pending) >= args.workers * 4:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                collect(done)
+            pending.add(ex.submit(process_pref, r["prefecture"].strip(), r["url"].strip(), args.max_per_pref))
+        collect(wait(pending).done)
+
+    if PARSE_POOL is not None:
+        PARSE_POOL.shutdown()
+
     results.sort(key=lambda x: x["prefecture"])
     with OUT_CSV.open("w", newline="", encoding="utf-8") as f:
         w = csv.DictWriter(f, fieldnames=[
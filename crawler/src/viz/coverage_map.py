@@ -12,12 +12,11 @@ OUT = Path("data/processed/coverage_map.html")
 # GeoJSONの都道府県名とCSVのprefecture列が一致する必要があります
 # 例: "北海道","青森県",...,"沖縄県"
 def main():
-    df = pd.read_csv(IN)
+    # キーは都道府県名。使う2列だけ型を決めて読む
+    df = pd.read_csv(IN, usecols=["prefecture","score10"],
+                     dtype={"prefecture": "string", "score10": "float32"})
     g = json.loads(GEO.read_text(encoding="utf-8"))
 
-    # キーは都道府県名
-    df = df[["prefecture","score10"]].copy()
-
     m = folium.Map(location=[36.5, 137.0], zoom_start=5, tiles="cartodbpositron")
 
     folium.Choropleth(
@@ -1,7 +1,10 @@
 #!/usr/bin/env python3
 # -*- coding: utf-8 -*-
 import pandas as pd
+import matplotlib
+matplotlib.use("Agg")  # PNG を保存するだけなので GUI バックエンドは読み込まない
 import matplotlib.pyplot as plt
+plt.ioff()
 from pathlib import Path
 import textwrap
 
@@ -12,6 +15,17 @@ IMG_BAR = IMG_DIR / "coverage_scores_bar.png"
 IMG_HIST = IMG_DIR / "coverage_scores_hist.png"
 IMG_SCAT = IMG_DIR / "coverage_scatter_htmlratio.png"
 
+# レポートで使う列だけを型を決めて読む（年は欠損ありなので nullable 整数）
+COLS = ["prefecture","score10","latest_year","hits_3y","html_ratio","has_backnumber"]
+DTYPES = {
+    "prefecture": "string",
+    "score10": "float64",
+    "latest_year": "Int16",
+    "hits_3y": "Int32",
+    "html_ratio": "float64",
+    "has_backnumber": "Int8",
+}
+
 def save_bar(df):
     s = df.sort_values("score10", ascending=False)
     plt.figure(figsize=(10, 9))
@@ -44,10 +58,10 @@ def save_scatter(df):
     plt.close()
 
 def main():
-    df = pd.read_csv(IN)
+    df = pd.read_csv(IN, usecols=COLS, dtype=DTYPES, engine="c")
     n = len(df)
-    top = df.nlargest(8, "score10")[["prefecture","score10","latest_year","hits_3y","html_ratio","has_backnumber"]]
-    worst = df.nsmallest(8, "score10")[["prefecture","score10","latest_year","hits_3y","html_ratio","has_backnumber"]]
+    top = df.nlargest(8, "score10")[COLS]
+    worst = df.nsmallest(8, "score10")[COLS]
 
     save_bar(df)
     save_hist(df)
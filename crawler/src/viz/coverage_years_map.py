@@ -2,6 +2,7 @@
 # -*- coding: utf-8 -*-
 import json
 from pathlib import Path
+import numpy as np
 import pandas as pd
 import folium
 
@@ -38,12 +39,11 @@ def pick_name_field(g):
 def main():
     # 1) read CSV and compute coverage_years
     df = pd.read_csv(CSV)
-    # guard: None -> 0
-    df["coverage_years"] = (
-        (df["latest_year"].fillna(0).astype(int) - df["earliest_year"].fillna(0).astype(int) + 1)
-        .where(df["earliest_year"].notna() & df["latest_year"].notna(), 0)
-        .clip(lower=0)
-    )
+    # guard: None -> 0（NumPy 上で1回だけ計算する）
+    ey = df["earliest_year"].to_numpy(dtype=float)
+    ly = df["latest_year"].to_numpy(dtype=float)
+    valid = ~(np.isnan(ey) | np.isnan(ly))
+    df["coverage_years"] = np.where(valid, np.maximum(0, ly - ey + 1), 0).astype(np.int64)
     # 保存（一覧も見たい時用）
     OUT_CSV.parent.mkdir(parents=True, exist_ok=True)
     df[["prefecture","earliest_year","latest_year","coverage_years"]].to_csv(OUT_CSV, index=False)
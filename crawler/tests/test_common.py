@@ -0,0 +1,26 @@
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1] / "src" / "crawl"))
+
+from common import html_tree, node_text
+
+
+XHTML = """<?xml version="1.0" encoding="UTF-8"?>
+<!DOCTYPE html PUBLIC "-//W3C//DTD XHTML 1.0 Transitional//EN" "http://www.w3.org/TR/xhtml1/DTD/xhtml1-transitional.dtd">
+<html xmlns="http://www.w3.org/1999/xhtml" lang="ja">
+<head><title>病害虫防除所</title></head>
+<body><h1>発生予察情報</h1><a href="yohou.html">予報</a><a href="/x/a.pdf">PDF</a></body>
+</html>"""
+
+
+def test_html_tree_xhtml_with_xml_declaration():
+    tree = html_tree(XHTML)
+    assert tree is not None
+    assert node_text(tree.find(".//title"), "") == "病害虫防除所"
+    assert tree.xpath("//a/@href") == ["yohou.html", "/x/a.pdf"]
+
+
+def test_html_tree_empty():
+    assert html_tree("") is None
+    assert html_tree("  \n") is None
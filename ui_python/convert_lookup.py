@@ -0,0 +1,36 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+prec_no_list.csv / station_list.csv を正規化済みの Parquet に変換する（1回実行すればよい）。
+streamlit_app.py は Parquet があればそれを読み、文字列の整形を毎回やり直さない。
+
+  uv run python convert_lookup.py
+"""
+from pathlib import Path
+
+import pandas as pd
+
+DATA_DIR = Path(__file__).resolve().parent / "data"
+PREC_CSV = DATA_DIR / "prec_no_list.csv"
+STATIONS_CSV = DATA_DIR / "station_list.csv"
+PREC_PARQUET = DATA_DIR / "prec_no_list.parquet"
+STATIONS_PARQUET = DATA_DIR / "station_list.parquet"
+
+def normalize_prec(df: pd.DataFrame) -> pd.DataFrame:
+    df["prec_no"] = df["prec_no"].astype(str).str.strip()
+    df["area"] = df["area"].astype(str).str.strip()
+    return df
+
+def normalize_stations(df: pd.DataFrame) -> pd.DataFrame:
+    df["prec_no"] = df["prec_no"].astype(str).str.strip()
+    df["block_no"] = df["block_no"].astype(str).str.zfill(5)
+    df["name"] = df["name"].astype(str).str.replace('"', '').str.strip()
+    return df
+
+def main():
+    normalize_prec(pd.read_csv(PREC_CSV)).to_parquet(PREC_PARQUET, index=False, compression="zstd")
+    normalize_stations(pd.read_csv(STATIONS_CSV)).to_parquet(STATIONS_PARQUET, index=False, compression="zstd")
+    print(f"Saved {PREC_PARQUET.name} and {STATIONS_PARQUET.name}")
+
+if __name__ == "__main__":
+    main()
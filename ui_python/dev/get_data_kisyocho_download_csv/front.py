@@ -1,31 +1,25 @@
 # show_data_from_fixed_header.py
 import pandas as pd
 from pathlib import Path
-from io import StringIO
 
 PATH = Path("data/many_points_data_utf8.csv")  # 対象CSV（UTF-8でもSJISでもOK）
 TARGET_DATE = pd.to_datetime("2025-04-20")     # 取り出したい日
 METRIC = "平均気温(℃)"                         # 例: "平均気温(℃)","最高気温(℃)","最低気温(℃)"
 
-def read_text(path: Path) -> str:
+def sniff_encoding(path: Path) -> str:
+    """先頭 64KB だけ見て utf-8 か cp932 かを決める（ファイル全体は読まない）"""
+    with path.open("rb") as f:
+        head = f.read(1 << 16)
     try:
-        return path.read_text(encoding="utf-8")
-    except UnicodeDecodeError:
-        return path.read_text(encoding="cp932")
+        head.decode("utf-8")
+    except UnicodeDecodeError as e:
+        if e.start < len(head) - 3:  # 末尾で多バイト文字が切れただけなら utf-8
+            return "cp932"
+    return "utf-8"
 
-# --- 1) テキストとして読み、3&4行目をヘッダ化、5&6行目を捨てて再構成 ---
-txt = read_text(PATH)
-lines = txt.splitlines()
-
-# 1-index基準: 3行目=地点, 4行目=要素, 1,2,5,6行目は不要
-header_names = lines[2]      # 3行目
-header_elems = lines[3]      # 4行目
-data_lines   = lines[6:]     # 7行目以降=データ本体
-
-subtxt = "\n".join([header_names, header_elems] + data_lines)
-
-# --- 2) 2段ヘッダとして読み込み（大量列に備えて engine='python'） ---
-df = pd.read_csv(StringIO(subtxt), header=[0, 1], engine="python")
+# --- 1) 3&4行目を2段ヘッダに、1,2,5,6行目は読み飛ばし（行の処理は C パーサに任せる） ---
+df = pd.read_csv(PATH, skiprows=[0, 1, 4, 5], header=[0, 1], engine="c",
+                 encoding=sniff_encoding(PATH), low_memory=False)
 
 # --- 3) 日付列（level=1 が '年月日' の列）を特定して index 化 ---
 def is_date_col(col):
@@ -41,23 +35,19 @@ df = df.set_index(date_col)
 
 # --- 4) 指定日の、指定METRICだけを抽出してプリント（観測所: 値） ---
 print(f"=== {TARGET_DATE.date()} の {METRIC} ===")
-row = df.loc[TARGET_DATE]   # 対象日1行ぶん（Wide形式）
-
-# 観測所（MultiIndex level=0）の一覧
-stations = sorted({c[0] for c in df.columns if isinstance(c, tuple)})
+# 先に METRIC の列だけに絞ってから対象日を引く（観測所 × 要素 の全列を1行に展開しない）
+sub = df.xs(METRIC, axis=1, level=1)   # 列: 観測所名, 行: 日付
+row = sub.loc[TARGET_DATE]             # 対象日1行ぶん（観測所名 → 値）
 
-count = 0
-for s in stations:
-    key = (s, METRIC)
-    if key in row.index and pd.notna(row[key]):
-        print(f"{s}: {row[key]}")
-        count += 1
-print(f"\n観測所数: {count}")
+# 観測所名順に表示（並べ替えるのは値のある観測所だけ）
+vals = row.dropna().sort_index()
+for s, val in vals.items():
+    print(f"{s}: {val}")
+print(f"\n観測所数: {len(vals)}")
 
 # --- 5) ついでにロング化（後で使う tidy 形） ---
 #   name,temp の2列だけのテーブルを作って、先頭だけ表示
-wide = row.xs(METRIC, axis=0, level=1)   # 1段目=観測所名の Series
-tidy = wide.reset_index()
+tidy = row.reset_index()
 tidy.columns = ["name", "temp"]
 print("\n--- tidy preview ---")
 print(tidy.head())
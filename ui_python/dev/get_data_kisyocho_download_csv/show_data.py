@@ -1,25 +1,27 @@
 # show_wide6.py
 import pandas as pd
 from pathlib import Path
-from io import StringIO
 
 SRC = Path("data/many_points_data_utf8.csv")
 METRIC = "平均気温(℃)"  # 必要に応じて "最高気温(℃)", "最低気温(℃)" に変更
 N_COLS = 6              # 表示する地点（列）数
 
-def read_text(p: Path) -> str:
-    try:
-        return p.read_text(encoding="utf-8")
-    except UnicodeDecodeError:
-        return p.read_text(encoding="cp932")
-
 # --- ヘッダ整形：3行目=地点, 4行目=要素。1,2,5,6行目は破棄 ---
-txt = read_text(SRC)
-lines = txt.splitlines()
-subtxt = "\n".join([lines[2], lines[3]] + lines[6:])  # 3&4行目をヘッダに、7行目以降がデータ
+# 行の読み飛ばしは C パーサに任せる（ファイル全体を文字列で持たない）
+def sniff_encoding(path: Path) -> str:
+    """先頭 64KB だけ見て utf-8 か cp932 かを決める（ファイル全体は読まない）"""
+    with path.open("rb") as f:
+        head = f.read(1 << 16)
+    try:
+        head.decode("utf-8")
+    except UnicodeDecodeError as e:
+        if e.start < len(head) - 3:  # 末尾で多バイト文字が切れただけなら utf-8
+            return "cp932"
+    return "utf-8"
 
 # --- 2段ヘッダで読み込み ---
-df = pd.read_csv(StringIO(subtxt), header=[0, 1], engine="python")
+df = pd.read_csv(SRC, skiprows=[0, 1, 4, 5], header=[0, 1], engine="c",
+                 encoding=sniff_encoding(SRC), low_memory=False)
 
 # --- 日付列（level1='年月日'）を特定して index化 ---
 date_cols = [c for c in df.columns if isinstance(c, tuple) and str(c[1]).strip() == "年月日"]
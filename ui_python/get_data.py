@@ -1,14 +1,26 @@
 # get_hourly_extras.py  ← 時刻, 気温, 降水量, 風速 を取得
 import requests
-from bs4 import BeautifulSoup
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from bs4 import BeautifulSoup, SoupStrainer
 import pandas as pd
 from datetime import datetime, timedelta
 
 BASE = "https://www.data.jma.go.jp/stats/etrn/view/hourly_s1.php"
+ONLY_TABLE = SoupStrainer("table", id="tablefix1")  # 1時間ごとのデータ表
 PARAMS = dict(prec_no="44", block_no="47662", year="2025", month="1", day="1", view="p1")
 
+# 接続を使い回す（日付・地点をループで回すときに TLS ハンドシェイクを毎回やらない）
+SESSION = requests.Session()
+SESSION.headers["User-Agent"] = "Mozilla/5.0"
+SESSION.mount("https://", HTTPAdapter(
+    pool_connections=4, pool_maxsize=8,
+    max_retries=Retry(total=3, backoff_factor=0.3, status_forcelist=[429, 500, 502, 503, 504],
+                      raise_on_status=False),
+))
+
 def to_num(s: str, zero_for_dash=False):
-    s = s.strip().replace("−","-")
+    s = s.strip().replace("−","-").replace("－","-")  # cp932 の負号は "－" にデコードされる
     if s in ("--","",None):
         return 0.0 if zero_for_dash else None
     try:
@@ -16,9 +28,11 @@ def to_num(s: str, zero_for_dash=False):
     except ValueError:
         return None
 
-resp = requests.get(BASE, params=PARAMS, headers={"User-Agent":"Mozilla/5.0"}, timeout=20)
+resp = SESSION.get(BASE, params=PARAMS, timeout=20)
 resp.raise_for_status()
-soup = BeautifulSoup(resp.content.decode("cp932","ignore"), "html.parser")
+# cp932 で読めないバイトは捨ててデコードし（UTF-8 のページや壊れたバイトで表を落とさない）、
+# データ表だけを C 実装の lxml でパース
+soup = BeautifulSoup(resp.content.decode("cp932", "ignore"), "lxml", parse_only=ONLY_TABLE)
 
 rows = []
 table = soup.select_one("#tablefix1")
@@ -1,22 +1,42 @@
 # jma_fetch.py
-import requests
-from bs4 import BeautifulSoup
+import threading
+import requests_cache
+from lxml import html as lxml_html
 import pandas as pd
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta
+from pathlib import Path
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 
 BASE = "https://www.data.jma.go.jp/stats/etrn/view/hourly_s1.php"
 
+DATA_DIR = Path(__file__).resolve().parent / "data"
 
-def _to_num(s: str, zero_for_dash=False):
-    if s is None:
-        return None
-    s = s.strip().replace("−", "-")
-    if s in ("--", ""):
-        return 0.0 if zero_for_dash else None
-    try:
-        return float(s)
-    except ValueError:
-        return None
+# 接続を使い回す（複数地点・複数日をまとめて取るときに効く）。
+# 過去日の時別値は変わらないので、同じURLはローカルの SQLite から返す
+SESSION = requests_cache.CachedSession(
+    str(DATA_DIR / "jma_cache"),
+    backend="sqlite",
+    expire_after=timedelta(days=7),
+    allowable_methods=("GET",),
+    stale_if_error=True,
+)
+SESSION.headers.update({"User-Agent": "Mozilla/5.0"})
+SESSION.mount("https://", HTTPAdapter(
+    pool_connections=4, pool_maxsize=16,
+    max_retries=Retry(total=3, backoff_factor=0.3, status_forcelist=[429, 500, 502, 503, 504],
+                      raise_on_status=False),
+))
+
+
+def _to_num_columns(df: pd.DataFrame, keys) -> pd.DataFrame:
+    """keys の列を一括で数値化。"−"/"－"（cp932 の負号）は "-" に、"--" と空欄は 0、数値にならないものは NaN"""
+    for key in keys:
+        s = df[key].str.strip().str.replace("[−－]", "-", regex=True)
+        s = s.mask(s.isin(["--", ""]), "0")
+        df[key] = pd.to_numeric(s, errors="coerce").astype(float)
+    return df
 
 # --- 英語キーへのマップ（列順はJMAの行データに対応） ---
 EXPECTED_HEADERS_JA = [
@@ -64,16 +84,29 @@ NUMERIC_KEYS = {
     "solar_radiation","snowfall","snow_depth","visibility"
 }
 
+# td[1] 以降の列順に並べた英語キーと、数値列かどうか（import 時に1回だけ引く）
+_KEYS = tuple(HEADER_MAP.get(ja, ja) for ja in EXPECTED_HEADERS_JA[1:])
+_IS_NUMERIC = tuple(k in NUMERIC_KEYS for k in _KEYS)
+
+# lxml のパーサはスレッドをまたいで共有できないので、スレッドごとに持つ
+_LOCAL = threading.local()
+
+def _parser():
+    p = getattr(_LOCAL, "parser", None)
+    if p is None:
+        p = _LOCAL.parser = lxml_html.HTMLParser(encoding="utf-8")
+    return p
+
 def _td_text(td):
     """テキストが空なら <img alt="…"> を拾う（天気記号用）"""
-    txt = td.get_text(strip=True).replace("\xa0", "")
+    txt = "".join(t.strip() for t in td.itertext()).replace("\xa0", "")
     if not txt:
-        img = td.find("img")
-        if img and img.get("alt"):
-            txt = img["alt"]
+        alts = td.xpath(".//img[1]/@alt")
+        if alts and alts[0]:
+            txt = alts[0]
     return txt
 
-def fetch_hourly_data(prec_no: str, block_no: str, date: datetime) -> pd.DataFrame:
+def _fetch_hourly_html(prec_no: str, block_no: str, date: datetime) -> bytes:
     params = dict(
         prec_no=str(int(prec_no)),
         block_no=str(block_no).zfill(5),
@@ -82,45 +115,54 @@ def fetch_hourly_data(prec_no: str, block_no: str, date: datetime) -> pd.DataFra
         day=str(date.day),
         view="p1",
     )
-    resp = requests.get(BASE, params=params, headers={"User-Agent": "Mozilla/5.0"}, timeout=20)
+    # 当日分はまだ増えるので1時間で取り直す（None ならセッションの既定 = 7日）
+    expire = 3600 if date.date() >= datetime.now().date() else None
+    resp = SESSION.get(BASE, params=params, timeout=20, expire_after=expire)
     resp.raise_for_status()
-    soup = BeautifulSoup(resp.content.decode("cp932", "ignore"), "html.parser")
+    return resp.content
 
-    table = soup.select_one("#tablefix1")
-    if table is None:
+def _parse_hourly_html(content: bytes, date: datetime) -> pd.DataFrame:
+    # cp932 で読めないバイトは捨ててデコードする（UTF-8 のページや壊れたバイトで表を落とさない）。
+    # lxml には UTF-8 に直して渡し、C 実装のパーサで読む
+    text = content.decode("cp932", "ignore")
+    tables = lxml_html.fromstring(text.encode("utf-8"), parser=_parser()).xpath('//table[@id="tablefix1"]')
+    if not tables:
         return pd.DataFrame()
 
-    trs = table.select("tr")
+    trs = tables[0].xpath(".//tr")
     if len(trs) < 3:
         return pd.DataFrame()
 
-    # データ行を読む（列順は上の EXPECTED_HEADERS_JA に一致）
+    # データ行のセルをまとめて文字列に（列順は上の EXPECTED_HEADERS_JA に一致）
+    cells = [[_td_text(td) for td in tr.xpath(".//td")] for tr in trs[2:]]
+    cells = [c for c in cells if c and c[0].isdigit()]
+    if not cells:
+        return pd.DataFrame()
+
     base = datetime(date.year, date.month, date.day)
-    rows = []
-    for tr in trs[2:]:
-        tds = tr.find_all("td")
-        if not tds:
-            continue
-        htxt = _td_text(tds[0])
-        if not htxt.isdigit():
-            continue
-
-        hour = int(htxt)
-        ts = (base + timedelta(days=1)).replace(hour=0) if hour == 24 else base.replace(hour=hour)
-
-        row = {"datetime": ts}
-        # tds[1] 以降を EXPECTED_HEADERS_JA[1:] に対応付け
-        for ja_name, td in zip(EXPECTED_HEADERS_JA[1:], tds[1:]):
-            key = HEADER_MAP.get(ja_name, ja_name)  # 英語キー
-            val = _td_text(td)
-            if key in NUMERIC_KEYS:
-                row[key] = _to_num(val, zero_for_dash=True)
-            else:
-                row[key] = val
-        rows.append(row)
-
-    df = pd.DataFrame(rows)
-    if not df.empty:
-        df = df.sort_values("datetime").reset_index(drop=True)
-    return df
+    hours = [int(c[0]) for c in cells]
+    stamps = [(base + timedelta(days=1)).replace(hour=0) if h == 24 else base.replace(hour=h) for h in hours]
+
+    # pandas には1回で渡す（数値化は後で列ごとにまとめて行う）
+    ncol = min(max(len(c) for c in cells) - 1, len(_KEYS))
+    df = pd.DataFrame([c[1:ncol + 1] for c in cells], columns=_KEYS[:ncol])
+    df.insert(0, "datetime", stamps)
+    df = _to_num_columns(df, [k for k, num in zip(_KEYS[:ncol], _IS_NUMERIC) if num])
+    return df.sort_values("datetime").reset_index(drop=True)
+
+def fetch_hourly_data(prec_no: str, block_no: str, date: datetime) -> pd.DataFrame:
+    return _parse_hourly_html(_fetch_hourly_html(prec_no, block_no, date), date)
+
+def fetch_many(triples, max_concurrency: int = 5):
+    """
+    (prec_no, block_no, date) の組をまとめて並行取得する。結果は入力と同じ順で、
+    失敗したものは例外オブジェクトをそのまま返す（asyncio.gather(return_exceptions=True) と同じ形）
+    """
+    def one(t):
+        try:
+            return fetch_hourly_data(*t)
+        except Exception as e:
+            return e
 
+    with ThreadPoolExecutor(max_workers=max_concurrency) as ex:
+        return list(ex.map(one, triples))
@@ -12,23 +12,35 @@ DATA_DIR = BASE_DIR / "data"                        # ui_python/data
 import sys
 if str(BASE_DIR) not in sys.path:
     sys.path.append(str(BASE_DIR))
+from convert_lookup import (PREC_CSV, PREC_PARQUET, STATIONS_CSV, STATIONS_PARQUET,
+                            normalize_prec, normalize_stations)
 
 st.set_page_config(page_title="JMA 時間別データビューア", layout="wide")
 
+def _fresh_parquet(parquet: Path, csv: Path) -> bool:
+    # convert_lookup.py で作った Parquet が CSV より新しければそちらを使う
+    return parquet.exists() and (not csv.exists() or parquet.stat().st_mtime >= csv.stat().st_mtime)
+
 @st.cache_data
 def load_prec() -> pd.DataFrame:
-    df = pd.read_csv(DATA_DIR / "prec_no_list.csv")   # ← ここを DATA_DIR に
-    df["prec_no"] = df["prec_no"].astype(str).str.strip()
-    df["area"] = df["area"].astype(str).str.strip()
+    if _fresh_parquet(PREC_PARQUET, PREC_CSV):
+        df = pd.read_parquet(PREC_PARQUET)   # 整形済み
+    else:
+        df = normalize_prec(pd.read_csv(PREC_CSV))
+    # セレクトボックスの表示名もここで作っておく（再実行のたびに文字列を組み立てない）
+    df["label"] = df["area"] + " (prec_no=" + df["prec_no"] + ")"
     return df
 
 @st.cache_data
 def load_stations() -> pd.DataFrame:
-    df = pd.read_csv(DATA_DIR / "station_list.csv")   # ← ここを DATA_DIR に
-    df["prec_no"] = df["prec_no"].astype(str).str.strip()
-    df["block_no"] = df["block_no"].astype(str).str.zfill(5)
-    df["name"] = df["name"].astype(str).str.replace('"', '').str.strip()
-    return df
+    if _fresh_parquet(STATIONS_PARQUET, STATIONS_CSV):
+        return pd.read_parquet(STATIONS_PARQUET)   # 整形済み（block_no は 0 埋め済み）
+    return normalize_stations(pd.read_csv(STATIONS_CSV))
+
+@st.cache_data(ttl=3600, max_entries=256, show_spinner=False)
+def cached_fetch(prec: str, block: str, d: date_cls) -> pd.DataFrame:
+    # 同じ (prec, block, date) の再表示はメモリから返す（ディスク側は jma_fetch の requests-cache）
+    return fetch_hourly_data(prec, block, pd.Timestamp(d).to_pydatetime())
 
 def _safe_line(df, col, title):
     if col in df.columns:
@@ -56,7 +68,7 @@ with st.container():
     with c1:
         area_label = st.selectbox(
             "都府県・地方（prec_no）",
-            options=(prec_df["area"] + " (prec_no=" + prec_df["prec_no"] + ")").tolist(),
+            options=prec_df["label"].tolist(),
             index=0 if len(prec_df) else None
         )
         sel_prec = area_label.split("prec_no=")[-1].strip(")") if area_label else None
@@ -79,7 +91,7 @@ with st.container():
 if run and sel_prec and station_label:
     sel_block = station_label.split("block_no=")[-1].strip(")")
     with st.spinner(f"取得中: prec_no={sel_prec}, block_no={sel_block}, date={sel_date}"):
-        df = fetch_hourly_data(sel_prec, sel_block, pd.Timestamp(sel_date).to_pydatetime())
+        df = cached_fetch(sel_prec, sel_block, sel_date)
 
     st.subheader("テーブル")
     if df.empty:
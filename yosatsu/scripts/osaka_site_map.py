@@ -6,7 +6,7 @@
 - 各年ページ内のPDFリンクを、見出し区分付きでCSV化
 
 使い方:
-  uv add requests beautifulsoup4 lxml python-dateutil
+  uv add requests lxml python-dateutil
   uv run python osaka_site_map.py \
     --base https://www.pref.osaka.lg.jp/o120090/nosei/byogaicyu/yohou/2024yohou.html \
     --outdir data/osaka_site_map
@@ -15,18 +15,31 @@
   data/osaka_site_map/backnumbers.csv
   data/osaka_site_map/entries.csv
 """
-import os, re, csv, time, argparse, hashlib
-from urllib.parse import urljoin, urlparse
+import os, re, csv, time, argparse, hashlib, threading
+from urllib.parse import urlparse
 import requests
-from bs4 import BeautifulSoup
-from datetime import date
+import requests_cache
+from lxml import html as lxml_html
+from datetime import date, timedelta
+from pathlib import Path
 
 # -------------------------
 # 設定
 # -------------------------
 HEADERS = {"User-Agent": "Mozilla/5.0 (research; yosatsu-site-map)"}
-SESSION = requests.Session()
+# HTTPキャッシュの置き場所はスクリプト基準（どこから実行・import しても yosatsu/data に置く）
+CACHE_DIR = Path(__file__).resolve().parent.parent / "data"
+# 同じURLは1日のあいだローカルの SQLite から返す（再実行時にサイトへ取りに行かない）
+SESSION = requests_cache.CachedSession(
+    str(CACHE_DIR / "http_cache"),
+    backend="sqlite",
+    expire_after=timedelta(days=1),
+    allowable_methods=("GET",),
+    stale_if_error=True,
+)
 SESSION.headers.update(HEADERS)
+# デコードは requests に任せる（res.text と同じ）ので、lxml には UTF-8 に直して渡す
+HTML_PARSER = lxml_html.HTMLParser(encoding="utf-8")
 
 WERA_OFFSET = {"令和": 2018, "平成": 1988, "昭和": 1925}  # 西暦=和暦年+オフセット
 
@@ -48,7 +61,30 @@ SECTION_HINTS = ["予報", "注意報", "警報", "特殊報", "防除情報", "
 # -------------------------
 # 共通ユーティリティ
 # -------------------------
+class HostLimiter:
+    """ホストごとのトークンバケツ。平均 rate 回/秒、溜まっていれば burst 回までは待たずに出す（スレッドセーフ）"""
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self.lock = threading.Lock()
+        self.buckets = {}  # host -> [残りトークン, 最終更新時刻]
+
+    def wait(self, host):
+        with self.lock:
+            now = time.monotonic()
+            tokens, last = self.buckets.get(host, (self.burst, now))
+            tokens = min(self.burst, tokens + (now - last) * self.rate) - 1
+            self.buckets[host] = [tokens, now]
+        # 足りなければ借りた分だけ待つ（先に借りた人から順に出られる）
+        if tokens < 0:
+            time.sleep(-tokens / self.rate)
+
+# main() で --sleep から作り直す（平均間隔 = 1/rate。0 なら待たない）
+HOSTS: HostLimiter | None = HostLimiter(rate=5.0, burst=5)
+
 def get(url: str, timeout: int = 20) -> requests.Response:
+    if HOSTS:
+        HOSTS.wait(urlparse(url).netloc)
     r = SESSION.get(url, timeout=timeout)
     r.raise_for_status()
     return r
@@ -74,32 +110,26 @@ def normalize_date(text: str) -> str | None:
             return None
     return None
 
-def nearest_section_text(a_tag) -> str:
-    """
-    PDFリンクの直近上位にある h2/h3 の見出しテキストを探す。
-    同階層で遡る → 親を辿る → ページ先頭へ、と段階的に探索。
-    """
-    # まず兄弟を遡って見出しを探す
-    cur = a_tag
-    for _ in range(30):
-        prev = cur.find_previous_sibling()
-        if prev is None:
-            break
-        if prev.name in ("h2", "h3"):
-            return " ".join(prev.get_text(" ").split())
-        cur = prev
-
-    # 親を辿りつつ、その直前の見出しを探索
-    parent = a_tag.parent
-    hops = 0
-    while parent and hops < 10:
-        h = parent.find_previous(["h2", "h3"])
-        if h:
-            return " ".join(h.get_text(" ").split())
-        parent = parent.parent
-        hops += 1
-
-    return ""  # 見つからなければ空
+def fetch_doc(url: str):
+    """ページを lxml の文書にして、リンクを絶対URLにしておく"""
+    res = get(url)
+    doc = lxml_html.fromstring(res.text.encode("utf-8"), parser=HTML_PARSER)
+    doc.make_links_absolute(url, handle_failures="ignore")
+    return doc
+
+def anchor_links(doc):
+    """<a href> を文書順に (要素, 絶対URL) で返す（iterlinks は C 側で属性を拾う）"""
+    for el, attr, link, _ in doc.iterlinks():
+        if attr == "href" and el.tag == "a":
+            yield el, link
+
+def node_text(el) -> str:
+    return " ".join(" ".join(el.itertext()).split())
+
+def nearest_section_text(a_el) -> str:
+    """PDFリンクより前にある直近の h2/h3 の見出しテキスト（XPath 1回で探す）"""
+    h = a_el.xpath("preceding::*[self::h2 or self::h3][1]")
+    return node_text(h[0]) if h else ""  # 見つからなければ空
 
 
 # -------------------------
@@ -109,15 +139,12 @@ def collect_backnumbers(base_url: str) -> list[tuple[str, str]]:
     """
     戻り値: [(year_label, url), ...]
     """
-    res = get(base_url)
-    soup = BeautifulSoup(res.text, "lxml")
+    doc = fetch_doc(base_url)
     pairs: list[tuple[str, str]] = []
 
-    for a in soup.select("a[href]"):
-        text = " ".join(a.get_text(" ").split())
+    for a, year_url in anchor_links(doc):
+        text = node_text(a)
         if "病害虫発生予察情報" in text and ("令和" in text or "平成" in text):
-            href = a.get("href")
-            year_url = urljoin(base_url, href)
             pairs.append((text, year_url))
 
     # 自ページ（該当年度）も含める（年ラベルを付けにくければそのまま入れる）
@@ -138,14 +165,13 @@ def parse_year_page(year_label: str, year_url: str) -> list[dict]:
     """
     各PDFリンクごとに辞書レコードを返す。
     """
-    res = get(year_url)
-    soup = BeautifulSoup(res.text, "lxml")
+    doc = fetch_doc(year_url)
 
     rows = []
-    for a in soup.select('a[href$=".pdf"], a[href*=".pdf?"]'):
-        href = a.get("href") or ""
-        pdf_url = urljoin(year_url, href)
-        anchor = " ".join(a.get_text(" ").split())
+    for a, pdf_url in anchor_links(doc):
+        if not (pdf_url.endswith(".pdf") or ".pdf?" in pdf_url):
+            continue
+        anchor = node_text(a)
         section = nearest_section_text(a)
 
         # 抽出
@@ -186,9 +212,12 @@ def main():
     ap = argparse.ArgumentParser()
     ap.add_argument("--base", required=True, help="起点（最新年度）ページURL")
     ap.add_argument("--outdir", required=True, help="出力ディレクトリ")
-    ap.add_argument("--sleep", type=float, default=0.2, help="礼儀的スリープ秒")
+    ap.add_argument("--sleep", type=float, default=0.2, help="同じホストへの平均リクエスト間隔（秒）")
     args = ap.parse_args()
 
+    global HOSTS
+    HOSTS = HostLimiter(rate=1.0 / args.sleep, burst=5) if args.sleep > 0 else None
+
     os.makedirs(args.outdir, exist_ok=True)
     back_csv = os.path.join(args.outdir, "backnumbers.csv")
     ent_csv = os.path.join(args.outdir, "entries.csv")
@@ -207,7 +236,6 @@ def main():
         rows = parse_year_page(lab, u)
         print(f"  -> {len(rows)} PDFs")
         all_rows.extend(rows)
-        time.sleep(args.sleep)
 
     if all_rows:
         fieldnames = [
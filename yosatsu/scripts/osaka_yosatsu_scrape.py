@@ -1,11 +1,17 @@
 #!/usr/bin/env python3
 # -*- coding: utf-8 -*-
-import re, os, sys, csv, time, hashlib
+import re, os, sys, csv, time, hashlib, shutil, threading
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 from dataclasses import dataclass, asdict
-from urllib.parse import urljoin, urlparse
+from datetime import timedelta
+from pathlib import Path
+from urllib.parse import urlparse
 
+import pypdfium2 as pdfium
 import requests
-from bs4 import BeautifulSoup
+import requests_cache
+from lxml import html as lxml_html
+from requests.adapters import HTTPAdapter
 
 BASE = "https://www.pref.osaka.lg.jp/o120090/nosei/byogaicyu/yohou/2024yohou.html"
 OUT_DIR = "data/osaka"
@@ -16,20 +22,50 @@ CATALOG_CSV = os.path.join(OUT_DIR, "osaka_yosatsu_catalog.csv")
 os.makedirs(RAW_DIR, exist_ok=True)
 os.makedirs(TEXT_DIR, exist_ok=True)
 
-SESS = requests.Session()
+# HTTPキャッシュの置き場所はスクリプト基準（どこから実行・import しても yosatsu/data/osaka に置く）
+CACHE_DIR = Path(__file__).resolve().parent.parent / "data" / "osaka"
+
+# 同じURLは1日のあいだローカルの SQLite から返す（再実行時にサイトへ取りに行かない）
+SESS = requests_cache.CachedSession(
+    str(CACHE_DIR / "http_cache"),
+    backend="sqlite",
+    expire_after=timedelta(days=1),
+    allowable_methods=("GET",),
+    stale_if_error=True,
+)
 SESS.headers.update({"User-Agent":"Mozilla/5.0 (+research; yosatsu-crawler)"})
+# デコードは requests に任せる（res.text と同じ）ので、lxml には UTF-8 に直して渡す
+HTML_PARSER = lxml_html.HTMLParser(encoding="utf-8")
+
+DL_WORKERS = 5        # PDF の同時ダウンロード数
+HOST_RATE = 5.0       # 同じホストへの平均リクエスト数（回/秒）
+HOST_BURST = 5        # 溜めておけるリクエスト数
+
+# PDF は RAW_DIR に残るのでキャッシュは通さず、ディスクへ直接流し込む（gzip の展開も不要）
+DL_SESS = requests.Session()
+DL_SESS.headers.update({"User-Agent": SESS.headers["User-Agent"], "Accept-Encoding": "identity"})
+DL_SESS.mount("https://", HTTPAdapter(pool_maxsize=DL_WORKERS))
 
 WERA = {"令和":2018,"平成":1988,"昭和":1925}
-ISSUE_TYPE_PAT = r"(発生予察|予察|注意報|警報|特殊報|発生情報|速報|解説)"
-LEVEL_PAT = r"(警報|注意報|注意|平年並み|やや多い|多発|少ない)"
+ISSUE_TYPE_PAT = re.compile(r"(発生予察|予察|注意報|警報|特殊報|発生情報|速報|解説)")
+LEVEL_PAT = re.compile(r"(警報|注意報|注意|平年並み|やや多い|多発|少ない)")
 
-CROP_PAT = r"(イネ|稲|水稲|陸稲|コムギ|ダイズ|トマト|ナス|ピーマン|キュウリ|イチゴ|ネギ|キャベツ|タマネギ)"
-PEST_PAT = r"(いもち|稲熱|斑点米カメムシ|コブノメイガ|シロイチモジヨトウ|ハスモンヨトウ|トビイロウンカ|ニカメイガ|トマトキバガ|白さび|べと病)"
+CROP_PAT = re.compile(r"(イネ|稲|水稲|陸稲|コムギ|ダイズ|トマト|ナス|ピーマン|キュウリ|イチゴ|ネギ|キャベツ|タマネギ)")
+PEST_PAT = re.compile(r"(いもち|稲熱|斑点米カメムシ|コブノメイガ|シロイチモジヨトウ|ハスモンヨトウ|トビイロウンカ|ニカメイガ|トマトキバガ|白さび|べと病)")
 
-DATE_PATS = [
-    r"(?P<y>\d{4})[./年](?P<m>\d{1,2})[./月](?P<d>\d{1,2})日?",
-    r"(?P<g>令和|平成|昭和)\s?(?P<y>\d+|元)年\s?(?P<m>\d{1,2})月\s?(?P<d>\d{1,2})日",
-]
+# 和暦/西暦を1本の正規表現で1回だけ走査する（\d++ は所有格で、数字列の後戻りをしない）
+DATE_RE = re.compile(
+    r"(?P<g>令和|平成|昭和)\s?(?P<gy>\d++|元)年\s?(?P<gm>\d{1,2})月\s?(?P<gd>\d{1,2})日"
+    r"|(?P<y>\d{4})[./年](?P<m>\d{1,2})[./月](?P<d>\d{1,2})日?"
+)
+# 日付・種類・程度・作物・病害虫を1回の走査で拾う。先読み (?=…) で文字を消費しないので、
+# 「水稲熱」のように位置がずれて重なる語（水稲 / 稲熱）も両方拾える。同じ位置から始まる語は
+# 病害虫（稲熱, トマトキバガ）を作物（稲, トマト）より、種類（注意報）を程度（注意）より先に置いて長い方を取る
+HINT_RE = re.compile(
+    rf"(?=(?P<date>{DATE_RE.pattern})|(?P<pest>{PEST_PAT.pattern})|(?P<type>{ISSUE_TYPE_PAT.pattern})"
+    rf"|(?P<level>{LEVEL_PAT.pattern})|(?P<crop>{CROP_PAT.pattern}))"
+)
+HINT_PATS = (("type", ISSUE_TYPE_PAT), ("level", LEVEL_PAT), ("crop", CROP_PAT), ("pest", PEST_PAT))
 
 @dataclass
 class Record:
@@ -54,59 +90,95 @@ class Record:
     is_text_pdf: bool = False
     text_hash: str = ""
 
+class HostLimiter:
+    """ホストごとのトークンバケツ。平均 rate 回/秒、溜まっていれば burst 回までは待たずに出す（スレッドセーフ）"""
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self.lock = threading.Lock()
+        self.buckets = {}  # host -> [残りトークン, 最終更新時刻]
+
+    def wait(self, host):
+        with self.lock:
+            now = time.monotonic()
+            tokens, last = self.buckets.get(host, (self.burst, now))
+            tokens = min(self.burst, tokens + (now - last) * self.rate) - 1
+            self.buckets[host] = [tokens, now]
+        # 足りなければ借りた分だけ待つ（先に借りた人から順に出られる）
+        if tokens < 0:
+            time.sleep(-tokens / self.rate)
+
+HOSTS = HostLimiter(HOST_RATE, HOST_BURST)
+
 def get(url):
     r = SESS.get(url, timeout=20)
     r.raise_for_status()
     return r
 
-def normalize_date(text):
-    if not text: return None
-    for pat in DATE_PATS:
-        m = re.search(pat, text)
-        if not m: continue
-        gd = m.groupdict()
-        if "g" in gd and gd.get("g"):
-            era = gd["g"]; y = gd["y"]; y = 1 if y=="元" else int(y)
-            y = WERA[era] + y
-        else:
-            y = int(gd["y"])
-        m_ = int(gd["m"]); d_ = int(gd["d"])
-        return f"{y:04d}-{m_:02d}-{d_:02d}"
-    return None
+def date_from_match(m):
+    if m["g"]:
+        y = m["gy"]; y = 1 if y=="元" else int(y)
+        y = WERA[m["g"]] + y
+        m_ = int(m["gm"]); d_ = int(m["gd"])
+    else:
+        y = int(m["y"]); m_ = int(m["m"]); d_ = int(m["d"])
+    return f"{y:04d}-{m_:02d}-{d_:02d}"
+
+def scan_hints(text):
+    """日付と各パターンの最初のヒットを返す（見つからないものは ""）"""
+    hits = dict.fromkeys(("date", "type", "level", "crop", "pest"), "")
+    for m in HINT_RE.finditer(text):
+        if m.lastgroup == "date":
+            hits["date"] = hits["date"] or date_from_match(m)
+            continue
+        # 「注意報」は種類にも程度にも、「稲熱」は作物（稲）にも当たるので、拾った語を各パターンで見直す
+        tok = m[m.lastgroup]
+        for key, pat in HINT_PATS:
+            if not hits[key]:
+                hm = pat.match(tok)
+                if hm:
+                    hits[key] = hm.group(1)
+        if all(hits.values()):
+            break
+    return hits
+
+def fetch_doc(url):
+    """ページを lxml の文書にして、リンクを絶対URLにしておく"""
+    res = get(url)
+    doc = lxml_html.fromstring(res.text.encode("utf-8"), parser=HTML_PARSER)
+    doc.make_links_absolute(url, handle_failures="ignore")
+    return doc
+
+def anchor_links(doc):
+    """<a href> を文書順に (要素, 絶対URL) で返す（iterlinks は C 側で属性を拾う）"""
+    for el, attr, link, _ in doc.iterlinks():
+        if attr == "href" and el.tag == "a":
+            yield el, link
 
 def parse_year_page(url):
     """その年のページからPDFリンク群を抽出"""
-    res = get(url)
-    soup = BeautifulSoup(res.text, "lxml")
+    doc = fetch_doc(url)
     # 本文内のPDFアンカーをすべて拾う
     recs = []
-    for a in soup.select('a[href$=".pdf"], a[href*=".pdf?"]'):
-        href = a.get("href") or ""
-        atxt = " ".join(a.get_text(" ").split())
-        pdf_url = urljoin(url, href)
+    for a, pdf_url in anchor_links(doc):
+        if not (pdf_url.endswith(".pdf") or ".pdf?" in pdf_url):
+            continue
+        atxt = " ".join(" ".join(a.itertext()).split())
         fn = os.path.basename(urlparse(pdf_url).path)
-        issued_hint = normalize_date(atxt)
-        issue_type = re.search(ISSUE_TYPE_PAT, atxt)
-        level = re.search(LEVEL_PAT, atxt)
-        crop = re.search(CROP_PAT, atxt)
-        pest = re.search(PEST_PAT, atxt)
-        recs.append((atxt, pdf_url, fn, issued_hint,
-                     issue_type.group(1) if issue_type else "",
-                     level.group(1) if level else "",
-                     crop.group(1) if crop else "",
-                     pest.group(1) if pest else ""))
+        h = scan_hints(atxt)
+        recs.append((atxt, pdf_url, fn, h["date"] or None,
+                     h["type"], h["level"], h["crop"], h["pest"]))
     return recs
 
 def find_backnumbers(start_url):
     """起点ページからバックナンバー年ページのURLを取得"""
-    res = get(start_url)
-    soup = BeautifulSoup(res.text, "lxml")
+    doc = fetch_doc(start_url)
     years = []
     # 下部に「病害虫発生予察情報(令和X年)」などのリンクが集約されている
-    for a in soup.select('a'):
-        t = a.get_text()
+    for a, link in anchor_links(doc):
+        t = a.text_content()
         if "病害虫発生予察情報" in t and ("令和" in t or "平成" in t):
-            years.append((t.strip(), urljoin(start_url, a.get("href"))))
+            years.append((t.strip(), link))
     # 今の年ページ自身も含める
     years.append(("この年ページ", start_url))
     # 重複除去
@@ -118,11 +190,42 @@ def find_backnumbers(start_url):
 
 def save_binary(url, out_path):
     if os.path.exists(out_path): return
-    r = get(url)
-    with open(out_path, "wb") as f:
-        f.write(r.content)
+    HOSTS.wait(urlparse(url).netloc)
+    tmp = out_path + ".part"  # 途中で落ちても壊れたPDFを「保存済み」と見なさない
+    with DL_SESS.get(url, stream=True, timeout=60) as r:
+        r.raise_for_status()
+        r.raw.decode_content = True  # identity を無視して圧縮してくるサーバ向け
+        with open(tmp, "wb") as f:
+            shutil.copyfileobj(r.raw, f, length=1 << 16)
+    os.replace(tmp, out_path)
+
+def file_sha16(path):
+    """保存済みPDFのバイト列を C 側でチャンクごとにハッシュ（テキストの UTF-8 コピーを作らない）"""
+    with open(path, "rb") as f:
+        return hashlib.file_digest(f, "sha256").hexdigest()[:16]
 
 def extract_pdf_text(path, maxpages=None):
+    """PDFium（C実装）でテキストを読む。PDFium で開けないPDFは pdfminer で読み直す"""
+    try:
+        pdf = pdfium.PdfDocument(path)
+    except pdfium.PdfiumError:
+        return extract_pdf_text_pdfminer(path, maxpages)
+    try:
+        n = len(pdf) if maxpages is None else min(maxpages, len(pdf))
+        parts = []
+        for i in range(n):
+            page = pdf[i]
+            textpage = page.get_textpage()
+            parts.append(textpage.get_text_range())
+            textpage.close()
+            page.close()
+        return "\n".join(parts)
+    except Exception:
+        return ""
+    finally:
+        pdf.close()
+
+def extract_pdf_text_pdfminer(path, maxpages=None):
     try:
         from pdfminer.high_level import extract_text
         txt = extract_text(path, maxpages=maxpages)
@@ -130,6 +233,10 @@ def extract_pdf_text(path, maxpages=None):
     except Exception:
         return ""
 
+def extract_pdf_text_any(path):
+    """全ページ→失敗/重いなら1P（プロセスプールから呼ぶのでモジュール直下に置く）"""
+    return extract_pdf_text(path, maxpages=None) or extract_pdf_text(path, maxpages=1)
+
 def text_density(txt):
     import math
     nonspace = len(re.findall(r"\S", txt))
@@ -137,23 +244,19 @@ def text_density(txt):
 
 def enrich_from_text(txt):
     # 本文から再抽出（アンカーで拾えない情報の上書き）
-    issued = normalize_date(txt)
-    issue_type = re.search(ISSUE_TYPE_PAT, txt)
-    level = re.search(LEVEL_PAT, txt)
-    crop = re.search(CROP_PAT, txt)
-    pest = re.search(PEST_PAT, txt)
+    h = scan_hints(txt)
     return {
-        "issued_date_from_text": issued or "",
-        "issue_type_from_text": issue_type.group(1) if issue_type else "",
-        "level_from_text": level.group(1) if level else "",
-        "crop_from_text": crop.group(1) if crop else "",
-        "pest_from_text": pest.group(1) if pest else "",
+        "issued_date_from_text": h["date"],
+        "issue_type_from_text": h["type"],
+        "level_from_text": h["level"],
+        "crop_from_text": h["crop"],
+        "pest_from_text": h["pest"],
     }
 
 def main():
     years = find_backnumbers(BASE)
     print(f"[years] {len(years)} pages")
-    rows = []
+    recs = []
     for year_label, page_url in years:
         print(f"[scan] {year_label} -> {page_url}")
         for (atxt, pdf_url, fn, d_hint, t_hint, lvl_hint, crop_hint, pest_hint) in parse_year_page(page_url):
@@ -170,30 +273,39 @@ def main():
                 crop_hint=crop_hint,
                 pest_hint=pest_hint,
             )
-            # 保存
-            out_pdf = os.path.join(RAW_DIR, fn)
-            save_binary(pdf_url, out_pdf)
-            rec.saved_path = out_pdf
-
-            # PDFテキスト抽出（全ページ→失敗/重いなら1P）
-            txt = extract_pdf_text(out_pdf, maxpages=None)
-            if not txt:
-                txt = extract_pdf_text(out_pdf, maxpages=1)
-            if txt:
-                h = hashlib.sha256(txt.encode("utf-8", "ignore")).hexdigest()[:16]
-                rec.text_hash = h
-                dens = text_density(txt)
-                rec.is_text_pdf = dens >= 0.02
-                tp = os.path.join(TEXT_DIR, fn.replace(".pdf",".txt"))
-                with open(tp, "w", encoding="utf-8") as f:
-                    f.write(txt)
-                rec.text_path = tp
-                upd = enrich_from_text(txt)
-                for k,v in upd.items():
-                    setattr(rec, k, v)
-
-            rows.append(asdict(rec))
-            time.sleep(0.2)  # 礼儀的スリープ
+            rec.saved_path = os.path.join(RAW_DIR, fn)
+            recs.append(rec)
+
+    # 保存（同じファイル名は最初のURLだけ取る。ホストごとの頻度は HostLimiter が守る）
+    todo = {}
+    for rec in recs:
+        todo.setdefault(rec.saved_path, rec.pdf_url)
+    print(f"[download] {len(todo)} pdfs")
+    with ThreadPoolExecutor(max_workers=DL_WORKERS) as ex:
+        list(ex.map(save_binary, todo.values(), todo.keys()))
+    # 同じPDFなら抽出結果が変わっても同じハッシュになる
+    hashes = {p: file_sha16(p) for p in todo}
+
+    # PDFテキスト抽出（CPU 律速なのでプロセスで並列化。PDFium はスレッドセーフでないのでスレッドは使わない）
+    paths = list(todo)
+    with ProcessPoolExecutor() as ex:
+        texts = dict(zip(paths, ex.map(extract_pdf_text_any, paths, chunksize=4)))
+
+    rows = []
+    for rec in recs:
+        rec.text_hash = hashes[rec.saved_path]
+        txt = texts[rec.saved_path]
+        if txt:
+            dens = text_density(txt)
+            rec.is_text_pdf = dens >= 0.02
+            tp = os.path.join(TEXT_DIR, rec.filename.replace(".pdf",".txt"))
+            with open(tp, "w", encoding="utf-8") as f:
+                f.write(txt)
+            rec.text_path = tp
+            upd = enrich_from_text(txt)
+            for k,v in upd.items():
+                setattr(rec, k, v)
+        rows.append(asdict(rec))
 
     # カタログ出力
     fieldnames = list(rows[0].keys()) if rows else [f.name for f in Record.__dataclass_fields__.values()]
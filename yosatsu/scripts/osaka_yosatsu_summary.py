@@ -7,24 +7,66 @@
 - 年度ごとのサマリーCSV + 全アイテムCSVを出力
 
 使い方例:
-  uv add requests beautifulsoup4 lxml python-dateutil
+  uv add requests requests-cache lxml python-dateutil brotli
   uv run python osaka_yosatsu_summary.py \
     --index https://www.pref.osaka.lg.jp/o120090/nosei/byogaicyu/yohou/ \
     --outdir data/osaka_summary
 """
-import os, re, csv, argparse
-from datetime import date
-from urllib.parse import urljoin, urlparse
+import os, re, csv, argparse, functools, multiprocessing
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from datetime import date, timedelta
+from pathlib import Path
+from urllib.parse import urljoin, urlsplit
 
 import requests
-from bs4 import BeautifulSoup, UnicodeDammit
+import requests_cache
+from charset_normalizer import from_bytes as detect_charset
+from lxml import etree, html as lxml_html
+from requests.adapters import HTTPAdapter
+from urllib3.util import make_headers
+from urllib3.util.retry import Retry
 
 # ----------------------
 # 設定
 # ----------------------
 HEADERS = {"User-Agent": "Mozilla/5.0 (yosatsu-summary)"}
-SESSION = requests.Session()
+# HTTPキャッシュの置き場所はスクリプト基準（どこから実行・import しても yosatsu/data に置く）
+CACHE_DIR = Path(__file__).resolve().parent.parent / "data"
+# 取得結果はローカルの SQLite に残す。1時間を過ぎたら ETag / Last-Modified で条件付き GET し、
+# 変わっていなければ 304 でキャッシュを使い回す（サーバの Cache-Control があればそちらを優先）
+SESSION = requests_cache.CachedSession(
+    str(CACHE_DIR / "http_cache_summary"),
+    backend="sqlite",
+    expire_after=timedelta(hours=1),
+    cache_control=True,
+    allowable_methods=("GET",),
+    stale_if_error=True,
+)
 SESSION.headers.update(HEADERS)
+# HTML は圧縮して受け取る。brotli が入っていれば br も名乗る（展開は urllib3 が1回だけ行う）
+SESSION.headers.update(make_headers(accept_encoding=True))
+# 年度ページを並列に取るので、同時接続ぶんの接続プールを用意する（Session はスレッド間で共有）。
+# 一時的な失敗で全体が止まらないよう軽くリトライ
+_adapter = HTTPAdapter(
+    pool_connections=32, pool_maxsize=32,
+    max_retries=Retry(total=3, backoff_factor=0.3, status_forcelist=[429, 500, 502, 503, 504],
+                      raise_on_status=False),
+)
+SESSION.mount("https://", _adapter)
+SESSION.mount("http://", _adapter)
+
+YEAR_WORKERS = 8     # 年度ページの同時取得数
+PARSE_WORKERS = None # 年度ページを解析するプロセス数（None = CPU コア数）
+
+# デコードは下の decode_html で済ませるので、lxml には UTF-8 に直して渡す
+HTML_PARSER = lxml_html.HTMLParser(encoding="utf-8")
+
+# XPath は一度だけコンパイルしておき、ページ・アンカーごとに使い回す
+_YEAR_ANCHORS = etree.XPath('//*[@id="tmp_contents"]//a[@href]')                 # 一覧ページの年度リンク
+_PDF_ANCHORS = etree.XPath('//a[substring(@href, string-length(@href) - 3) = ".pdf"'
+                           ' or contains(@href, ".pdf?")]')                      # a[href$=".pdf"], a[href*=".pdf?"]
+_PREV_HEADING = etree.XPath("(preceding::h2 | preceding::h3 | preceding::h4)[last()]")
 
 WERA_OFFSET = {"令和": 2018, "平成": 1988, "昭和": 1925}  # 西暦 = 和暦年 + オフセット
 
@@ -37,17 +79,43 @@ SECTION_CANON = {
     "その他の防除情報": ["その他の防除情報", "防除情報"]
 }
 
+# SECTION_CANON を1本の正規表現に。分岐ごとに先読みで文字列全体を見るので、
+# 「最初にマッチした代表語」ではなく SECTION_CANON の順で最初に当たった区分が選ばれる（グループ名 = 区分名）
+_SECTION_RE = re.compile("|".join(
+    f"(?=.*?(?:{'|'.join(map(re.escape, hints))}))(?P<{canon}>)"
+    for canon, hints in SECTION_CANON.items()
+), re.S)
+
+# 一覧ページで年度ページへのリンクとみなすアンカー文（「年度へ」と「令和/平成」をどちらの順でも含む）
+_YEAR_LABEL_RE = re.compile(r"(?=.*?(?:令和|平成)).*?年度へ", re.S)
+
+# 年度ラベルから和暦の年を拾う（年度ページの並べ替え用）
+_LABEL_ERA_RE = re.compile(r"(令和|平成)\s*(\d+|元)")
+
+# 出力CSVの列（レコードはこの順のタプルで持つ）
+ITEM_FIELDS = ("pref","year_label","page_url","section_raw","section",
+               "item_title","pdf_url","filename","issued_date_iso")
+_I_SECTION = ITEM_FIELDS.index("section")
+_I_ISSUED = ITEM_FIELDS.index("issued_date_iso")
+SUMMARY_FIELDS = ("pref","year_label","page_url","total_pdfs","予報_count","注意報_count",
+                  "警報_count","特殊報_count","その他の防除情報_count",
+                  "first_issued_date","last_issued_date")
+
 # 和暦/西暦日付の抽出（アンカー文から）
 DATE_PATS = [
     re.compile(r"(?P<y>\d{4})[./年](?P<m>\d{1,2})[./月](?P<d>\d{1,2})日?"),
     re.compile(r"(?P<g>令和|平成|昭和)\s*(?P<y>\d+|元)\s*年\s*(?P<m>\d{1,2})\s*月\s*(?P<d>\d{1,2})\s*日"),
 ]
 
+# search をあらかじめ束縛しておく（アンカーごとの属性引きを省く）
+_DATE_SEARCHERS = tuple(p.search for p in DATE_PATS)
+
+@functools.lru_cache(maxsize=4096)  # 同じアンカー文（重複タイトル等）は再計算しない
 def normalize_date(text: str) -> str | None:
     if not text:
         return None
-    for pat in DATE_PATS:
-        m = pat.search(text)
+    for search in _DATE_SEARCHERS:
+        m = search(text)
         if not m:
             continue
         gd = m.groupdict()
@@ -64,131 +132,162 @@ def normalize_date(text: str) -> str | None:
             return None
     return None
 
-def fetch_soup(url: str, timeout: int = 20) -> BeautifulSoup:
-    """バイト列→UnicodeDammit→cp932フォールバックでデコード安定化"""
+def fetch_page(url: str, timeout: int = 20) -> tuple[bytes, str | None]:
+    """本文のバイト列と、Content-Type に charset が明示されていればその値を返す"""
     r = SESSION.get(url, timeout=timeout)
     r.raise_for_status()
-    raw = r.content
-    dammit = UnicodeDammit(raw, is_html=True)
-    html = dammit.unicode_markup
-    if (not html) or ("\u0080" in html) or ("�" in html and "charset" not in (html[:400].lower())):
-        try:
-            html = raw.decode("cp932", errors="ignore")
-        except Exception:
-            r.encoding = r.apparent_encoding or "utf-8"
-            html = r.text
-    return BeautifulSoup(html, "lxml")
+    ct = r.headers.get("Content-Type", "")
+    # charset が無いときの requests の既定値（ISO-8859-1）は使わない
+    charset = requests.utils.get_encoding_from_headers(r.headers) if "charset" in ct.lower() else None
+    return r.content, charset
+
+def decode_html(raw: bytes, charset: str | None = None) -> str:
+    """ヘッダの charset（無ければ UTF-8）でそのままデコード。失敗したときだけ中身から文字コードを推定"""
+    try:
+        return raw.decode(charset or "utf-8")
+    except (UnicodeDecodeError, LookupError):
+        best = detect_charset(raw).best()
+        return raw.decode(best.encoding if best else "cp932", errors="replace")
+
+def tree_from_bytes(raw: bytes, charset: str | None = None):
+    return lxml_html.fromstring(decode_html(raw, charset).encode("utf-8"), parser=HTML_PARSER)
+
+def fetch_tree(url: str, timeout: int = 20):
+    return tree_from_bytes(*fetch_page(url, timeout=timeout))
+
+_WS = re.compile(r"\s+")
+
+def node_text(el) -> str:
+    """要素のテキストを空白1つ区切りに（<br> やタグの境目も空白1つ）"""
+    return _WS.sub(" ", " ".join(el.itertext())).strip()
+
+def make_joiner(base_url: str):
+    """
+    base_url 基準の urljoin。ページ内の href はほとんどが絶対URLかルート相対（/o120090/...）なので、
+    その2つは文字列の連結だけで返し、それ以外（相対パス、//host、. や .. を含むもの）は urljoin に任せる
+    """
+    sp = urlsplit(base_url)
+    root = f"{sp.scheme}://{sp.netloc}"
+    def join(href: str) -> str:
+        if href.startswith(("http://", "https://")):
+            return href
+        if href.startswith("/") and not href.startswith("//") and "/." not in href:
+            return root + href
+        return urljoin(base_url, href)
+    return join
+
+def basename_from_url(u: str) -> str:
+    """os.path.basename(urlparse(u).path) と同じ結果を文字列の分割だけで（#・? 以降と末尾の ;params を落とす）"""
+    u = u.split("#", 1)[0].split("?", 1)[0]
+    if u.find("/", u.find("//") + 2) < 0:  # パスが無い（https://host だけ）
+        return ""
+    return u.rsplit("/", 1)[-1].split(";", 1)[0]
 
 def pick_year_pages(index_url: str) -> list[tuple[str, str]]:
     """
     バックナンバー一覧ページから「令和x/平成x 年度へ」の年度ページURLを拾う。
     戻り値: [(year_label, year_url), ...]
     """
-    soup = fetch_soup(index_url)
+    tree = fetch_tree(index_url)
+    join = make_joiner(index_url)
     pairs: list[tuple[str, str]] = []
-    for a in soup.select("#tmp_contents a[href]"):
-        t = " ".join(a.get_text(" ", strip=True).split())
-        if ("年度へ" in t) and ("令和" in t or "平成" in t):
-            pairs.append((t, urljoin(index_url, a.get("href"))))
-    # 重複除去
+    for a in _YEAR_ANCHORS(tree):
+        t = node_text(a)
+        if _YEAR_LABEL_RE.match(t):
+            pairs.append((t, join(a.get("href"))))
+    # 重複除去（同じURLは後のラベルで上書き）
     seen = {}
     for lab, u in pairs:
         seen[u] = lab
-    return [(lab, u) for u, lab in sorted(seen.items(), key=lambda x: x[0], reverse=True)]
+    # 新しい年度から。URL の文字列順は年の順とは限らないので、ラベルの和暦を西暦にして並べる
+    return [(lab, u) for u, lab in sorted(seen.items(), key=lambda x: (label_year(x[1]), x[0]), reverse=True)]
 
+def label_year(label: str) -> int:
+    """「令和6年度へ」→ 2024。年が読めなければ 0（末尾に回す）"""
+    m = _LABEL_ERA_RE.search(label)
+    if not m:
+        return 0
+    y = 1 if m.group(2) == "元" else int(m.group(2))
+    return WERA_OFFSET[m.group(1)] + y
+
+@functools.lru_cache(maxsize=1024)  # ページ内の見出しは数種類しかない
 def canon_section(s: str) -> str:
-    """見出しテキストから標準化ラベルを決める（最初にマッチしたもの）"""
+    """見出しテキストから標準化ラベルを決める（SECTION_CANON の順で最初に当たったもの）"""
     s = (s or "").strip()
-    for canon, hints in SECTION_CANON.items():
-        for h in hints:
-            if h in s:
-                return canon
+    m = _SECTION_RE.match(s)
     # どれにも当たらない場合は元の見出しを返す（保険）
-    return s or ""
+    return m.lastgroup if m else s
 
-def parse_year_page(year_label: str, year_url: str) -> list[dict]:
+def parse_year_page_from_bytes(body: bytes, year_label: str, year_url: str,
+                               charset: str | None = None) -> list[tuple]:
     """
-    年度ページからPDFリンク（1レコード=1PDF）を抽出。
-    セクションは <h2>/<h3>/<h4> を上へ辿って最寄りの見出しを採用。
+    取得済みの年度ページからPDFリンク（1レコード=1PDF、ITEM_FIELDS 順のタプル）を抽出。
+    セクションは文書順で直前にある <h2>/<h3>/<h4> の見出しを採用。
+    同じPDFへのリンクがページ内に複数あるとき（「表示」と「ダウンロード」等）は最初の1件だけ残す。
     """
-    soup = fetch_soup(year_url)
+    tree = tree_from_bytes(body, charset)
+    join = make_joiner(year_url)
     rows = []
-    for a in soup.select('a[href$=".pdf"], a[href*=".pdf?"]'):
+    seen: set[str] = set()
+    for a in _PDF_ANCHORS(tree):
         href = a.get("href") or ""
-        pdf_url = urljoin(year_url, href)
-        anchor = " ".join(a.get_text(" ", strip=True).split())
-
-        # 近傍の見出しを探索
-        sec = ""
-        cur = a
-        for _ in range(24):
-            prev = cur.find_previous_sibling()
-            if not prev:
-                break
-            if prev.name in ("h2", "h3", "h4"):
-                sec = " ".join(prev.get_text(" ", strip=True).split())
-                break
-            cur = prev
-        if not sec:
-            parent = a.parent
-            hop = 0
-            while parent and hop < 8 and not sec:
-                h = parent.find_previous(["h2", "h3", "h4"])
-                if h:
-                    sec = " ".join(h.get_text(" ", strip=True).split())
-                    break
-                parent = parent.parent
-                hop += 1
+        pdf_url = join(href)
+        # 重複は見出し探索や日付抽出の前に捨てる
+        if pdf_url in seen:
+            continue
+        seen.add(pdf_url)
+        anchor = node_text(a)
+
+        # 文書順で直前の見出し（h2/h3/h4）。探索は libxml2 の XPath 1回で済ませる
+        prec = _PREV_HEADING(a)
+        sec = node_text(prec[0]) if prec else ""
 
         sec_canon = canon_section(sec)
         issued_iso = normalize_date(anchor)
 
-        rows.append({
-            "pref": "大阪府",
-            "year_label": year_label,
-            "page_url": year_url,
-            "section_raw": sec,
-            "section": sec_canon,
-            "item_title": anchor,
-            "pdf_url": pdf_url,
-            "filename": os.path.basename(urlparse(pdf_url).path),
-            "issued_date_iso": issued_iso or ""
-        })
+        rows.append((
+            "大阪府",                                  # pref
+            year_label,
+            year_url,                                  # page_url
+            sec,                                       # section_raw
+            sec_canon,                                 # section
+            anchor,                                    # item_title
+            pdf_url,
+            basename_from_url(pdf_url),                # filename
+            issued_iso or "",                          # issued_date_iso
+        ))
     return rows
 
-def make_summary_per_year(items: list[dict]) -> dict:
-    """年度内のPDFアイテムから件数と日付レンジのサマリーを作る"""
-    total = len(items)
-    by_sec = {}
-    dates = []
-    for r in items:
-        by_sec[r["section"]] = by_sec.get(r["section"], 0) + 1
-        if r["issued_date_iso"]:
-            dates.append(r["issued_date_iso"])
-    first_date = min(dates) if dates else ""
-    last_date  = max(dates) if dates else ""
+def make_summary_per_year(year_label: str, page_url: str, entries: list[tuple[str, str]]) -> tuple:
+    """年度内のPDFアイテム（(section, issued_date_iso) の組）から件数と日付レンジのサマリーを作る（SUMMARY_FIELDS 順）"""
+    total = len(entries)
+    # 件数と最初/最後の日付を1回の走査で（ISO 形式なので文字列比較で日付順になる）
+    by_sec = Counter()
+    first_date = last_date = ""
+    for sec, issued in entries:
+        by_sec[sec] += 1
+        if issued:
+            if not first_date or issued < first_date:
+                first_date = issued
+            if issued > last_date:
+                last_date = issued
     # 代表セクションを固定列で
-    out = {
-        "pref": items[0]["pref"] if items else "大阪府",
-        "year_label": items[0]["year_label"] if items else "",
-        "page_url": items[0]["page_url"] if items else "",
-        "total_pdfs": total,
-        "予報_count": by_sec.get("予報", 0),
-        "注意報_count": by_sec.get("注意報", 0),
-        "警報_count": by_sec.get("警報", 0),
-        "特殊報_count": by_sec.get("特殊報", 0),
-        "その他の防除情報_count": by_sec.get("その他の防除情報", 0),
-        "first_issued_date": first_date,
-        "last_issued_date": last_date,
-    }
-    return out
+    return (
+        "大阪府", year_label, page_url, total,
+        by_sec["予報"], by_sec["注意報"], by_sec["警報"], by_sec["特殊報"], by_sec["その他の防除情報"],
+        first_date, last_date,
+    )
 
 def main():
     ap = argparse.ArgumentParser()
     ap.add_argument("--index", required=True, help="バックナンバー一覧ページのURL（/yohou/ 直下）")
     ap.add_argument("--outdir", required=True, help="出力ディレクトリ")
+    ap.add_argument("--no-cache", action="store_true", help="HTTPキャッシュを消してから取り直す")
     args = ap.parse_args()
 
+    if args.no_cache:
+        SESSION.cache.clear()
+
     os.makedirs(args.outdir, exist_ok=True)
     items_csv = os.path.join(args.outdir, "items_all.csv")
     summary_csv = os.path.join(args.outdir, "summary_by_year.csv")
@@ -196,35 +295,51 @@ def main():
     year_pages = pick_year_pages(args.index)
     print(f"[year pages] {len(year_pages)}")
 
-    all_items = []
     for ylab, yurl in year_pages:
         print(f"  - {ylab}: {yurl}")
-        rows = parse_year_page(ylab, yurl)
-        all_items.extend(rows)
-
-    # 書き出し（全アイテム）
-    if all_items:
-        fieldnames = ["pref","year_label","page_url","section_raw","section",
-                      "item_title","pdf_url","filename","issued_date_iso"]
-        with open(items_csv, "w", newline="", encoding="utf-8") as f:
-            w = csv.DictWriter(f, fieldnames=fieldnames)
-            w.writeheader()
-            w.writerows(all_items)
-        print(f"[write] {items_csv} ({len(all_items)} rows)")
+
+    # 全アイテムはメモリに溜めず、年度ページを解析するたびに書き出す（最初の行が出るまでファイルは作らない）
+    f = w = None
+    n_items = 0
+    # 年度サマリー用には (section, issued_date_iso) だけ残す。year_label -> (最初の page_url, [...])
+    by_year: dict[str, tuple[str, list[tuple[str, str]]]] = {}
+    try:
+        # 年度ページは互いに独立なので、取得（待ち時間）はスレッドで重ね、
+        # 解析（CPU 処理）は届いたものから別プロセスに回して GIL を避ける。
+        # プロセス間で受け渡すのは本文のバイト列と文字列だけ。書き出しは year_pages の順。
+        # 取得スレッドが動いている最中に fork しないよう spawn で起動する
+        with ThreadPoolExecutor(max_workers=YEAR_WORKERS) as fetch_ex, \
+             ProcessPoolExecutor(max_workers=PARSE_WORKERS,
+                                 mp_context=multiprocessing.get_context("spawn")) as parse_ex:
+            pages = fetch_ex.map(fetch_page, [u for _, u in year_pages])
+            parsed = [parse_ex.submit(parse_year_page_from_bytes, body, ylab, yurl, charset)
+                      for (ylab, yurl), (body, charset) in zip(year_pages, pages)]
+            for (ylab, yurl), fut in zip(year_pages, parsed):
+                rows = fut.result()
+                if not rows:
+                    continue
+                if w is None:
+                    f = open(items_csv, "w", newline="", encoding="utf-8")
+                    w = csv.writer(f)
+                    w.writerow(ITEM_FIELDS)
+                w.writerows(rows)
+                n_items += len(rows)
+                entries = by_year.setdefault(ylab, (yurl, []))[1]
+                entries.extend((r[_I_SECTION], r[_I_ISSUED]) for r in rows)
+    finally:
+        if f is not None:
+            f.close()
+    if n_items:
+        print(f"[write] {items_csv} ({n_items} rows)")
 
     # 年度サマリー
-    by_year = {}
-    for r in all_items:
-        by_year.setdefault(r["year_label"], []).append(r)
-    summaries = [make_summary_per_year(v) for _, v in sorted(by_year.items(), reverse=True)]
+    summaries = [make_summary_per_year(ylab, yurl, entries)
+                 for ylab, (yurl, entries) in sorted(by_year.items(), reverse=True)]
 
     if summaries:
-        fieldnames = ["pref","year_label","page_url","total_pdfs","予報_count","注意報_count",
-                      "警報_count","特殊報_count","その他の防除情報_count",
-                      "first_issued_date","last_issued_date"]
         with open(summary_csv, "w", newline="", encoding="utf-8") as f:
-            w = csv.DictWriter(f, fieldnames=fieldnames)
-            w.writeheader()
+            w = csv.writer(f)
+            w.writerow(SUMMARY_FIELDS)
             w.writerows(summaries)
         print(f"[write] {summary_csv} ({len(summaries)} rows)")
 